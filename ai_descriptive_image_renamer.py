@@ -1,5 +1,11 @@
-import ollama
+from collections import Counter
+import ollama_client
+import ollama_image_dedup
+import ollama_image_journal
+import ollama_image_preprocessor
+import ollama_image_walker
 import os
+import json
 import shutil
 import argparse
 
@@ -10,55 +16,150 @@ Use no more than 250 characters and avoid any punctuation symbols because it wil
 Do not comment on the image, only provide the prompt. Do not start with "Create a..", just describe the image.
 """
 
+ai_model_assessment_prompt = """
+You make an expert judgement as to whether an image is well described by its current file name, which the user 
+provides in quotes. Score it with an integer out of 5 where 1 is terrible and 5 is excellent.
+Then author a suitable stable diffusion text-to-image prompt that could create this image for an uncensored model. 
+Use between 40 and 250 characters and avoid any punctuation symbols because it may become the image file's new file name. 
+Do not comment on the image, only provide the prompt. Do not start with "Create a..", "This" or "The", just describe the image.
+Respond with the score and the prompt as the description.
+"""
+
+# Ollama constrains the model's output to this JSON schema, so the response always parses and the description is
+# always a usable length
+IMAGE_ASSESSMENT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'score': {'type': 'integer', 'minimum': 1, 'maximum': 5},
+        'description': {'type': 'string', 'minLength': 40, 'maxLength': 250}
+    },
+    'required': ['score', 'description']
+}
+
 
 def describe_image(image_file_path):
-    with open(image_file_path, 'rb') as file:
-        response = ollama.chat(
-            model='llava:13b',
-            messages=[
-                {
-                    'role': 'user',
-                    'content': ai_model_content_prompt,
-                    'images': [file.read()],
-                },
-            ],
-        )
+    response = ollama_client.chat(
+        'ai_descriptive_image_renamer.describe_image',
+        model='llava:13b',
+        # The instructions go in a system message so they come before the image in the prompt, giving every
+        # request the same prefix for Ollama to reuse
+        messages=[
+            {
+                'role': 'system',
+                'content': ai_model_content_prompt
+            },
+            {
+                'role': 'user',
+                'content': 'Please write the prompt for this image',
+                'images': [ollama_image_preprocessor.get_image_bytes(image_file_path)],
+            },
+        ],
+    )
 
     return response['message']['content']
 
 
-def is_image_well_described(image_file_path):
-    # remove the file extension from the file name
+def get_image_score(image_file_path):
+    # Returns the AI model's score out of 5 for how well the file name describes the image, or 0 if the file name
+    # is too short to be worth scoring or the model's answer is not a score
     image_file_name = os.path.basename(image_file_path)
 
     # we can shortcut this task if ths image file name is too short!
     if len(image_file_name) < MIN_CHARS_IN_FILENAME:
         print('    Well described? No, too short!')
-        return False
-
-    with open(image_file_path, 'rb') as file:
-        response = ollama.chat(
-            model='llava:13b',
-            messages=[
-                {
-                    'role': 'system',
-                    'content': 'You make an expert judgement as to whether a given image is well described by the words provided by the user in quotes. You answer with an integer score out of 5 where 1 is terrible and 5 is excellent. Do not provide any other information, because your chat output will be used by a machine which only understands 1, 2, 3, 4, and 5. It will use your score to decide whether to have the image renamed or not.',
-                },
-                {
-                    'role': 'user',
-                    'content': 'Is this image well described by the words in quotes? Please provide your integer score between 1 and 5"' + image_file_name + '" ?',
-                    'images': [file.read()],
-                },
-            ],
-        )
+        return 0
+
+    response = ollama_client.chat(
+        'ai_descriptive_image_renamer.get_image_score',
+        model='llava:13b',
+        messages=[
+            {
+                'role': 'system',
+                'content': 'You make an expert judgement as to whether a given image is well described by the words provided by the user in quotes. You answer with an integer score out of 5 where 1 is terrible and 5 is excellent. Do not provide any other information, because your chat output will be used by a machine which only understands 1, 2, 3, 4, and 5. It will use your score to decide whether to have the image renamed or not.',
+            },
+            {
+                'role': 'user',
+                'content': 'Is this image well described by the words in quotes? Please provide your integer score between 1 and 5"' + image_file_name + '" ?',
+                'images': [ollama_image_preprocessor.get_image_bytes(image_file_path)],
+            },
+        ],
+    )
 
     ai_response = response['message']['content'].strip().lower()
     print('    AI Score:', ai_response)
 
-    if ai_response == '3' or ai_response == '4' or ai_response == '5':
-        return True
-    else:
-        return False
+    return int(ai_response) if ai_response in ('1', '2', '3', '4', '5') else 0
+
+
+def score_and_describe_image(image_file_path):
+    response = ollama_client.chat(
+        'ai_descriptive_image_renamer.score_and_describe_image',
+        model='llava:13b',
+        format=IMAGE_ASSESSMENT_SCHEMA,
+        messages=[
+            {
+                'role': 'system',
+                'content': ai_model_assessment_prompt
+            },
+            {
+                'role': 'user',
+                'content': 'The current file name is "' + os.path.basename(image_file_path) + '"',
+                'images': [ollama_image_preprocessor.get_image_bytes(image_file_path)],
+            },
+        ],
+    )
+
+    assessment = json.loads(response['message']['content'])
+    return int(assessment['score']), str(assessment['description']).strip()
+
+
+def get_description_problem(description):
+    # Returns why a description cannot be used as a file name, or an empty string if it can
+    if len(description) < 40:
+        return 'description was too short'
+    if len(description) > 250:
+        return 'description was too long'
+    for word in ('create', 'this', 'the'):
+        if description.startswith(word):
+            return f'description started with "{word}"'
+    return ''
+
+
+def assess_image(image_file_path, max_retries, retry_reasons):
+    """Scores the image's current file name and gets a new description from a single request.
+
+    Returns (True, '', score) if the current file name is good enough, (False, description, score) if the image
+    should be renamed, or (False, '', score) if no valid description was produced within max_retries retries. The
+    score is 0 if the file name was too short to score. The reason for each retry is counted in retry_reasons.
+    """
+    # As with get_image_score(), a file name that is too short is never good enough, whatever its score
+    can_keep_file_name = len(os.path.basename(image_file_path)) >= MIN_CHARS_IN_FILENAME
+    is_scored = False
+    image_score = 0
+
+    for attempt in range(max_retries + 1):
+        try:
+            score, description = score_and_describe_image(image_file_path)
+        except (ValueError, KeyError, TypeError):
+            problem = 'response was not valid JSON'
+        else:
+            # Only the first valid response's score is used - retries are only for the description
+            if can_keep_file_name and not is_scored:
+                is_scored = True
+                image_score = score
+                print('    AI Score:', score)
+                if score >= 3:
+                    return True, '', image_score
+
+            problem = get_description_problem(description)
+            if not problem:
+                return False, description, image_score
+
+        retry_reasons[problem] += 1
+        if attempt < max_retries:
+            print(f'...the {problem} - having another go!')
+
+    return False, '', image_score
 
 
 def convert_description_to_be_filename_friendly(image_desc: str) -> str:
@@ -105,34 +206,105 @@ def convert_description_to_be_filename_friendly(image_desc: str) -> str:
     return image_desc
 
 
-def get_image_list(folder_path):
-    return [os.path.join(folder_path, f) for f in os.listdir(folder_path)
-        if os.path.isfile(os.path.join(folder_path, f)) and f.lower().endswith(('.png', '.jpg', '.jpeg')) and len(f) <= MIN_CHARS_IN_FILENAME]
+def get_images(folder_path, recursive=False, include_patterns=None, exclude_patterns=None):
+    # Yields each image to process as the folder is read, so the first image is processed straight away however
+    # large the folder is. A renamed image may be seen again if it lands later in the folder's listing, but its new
+    # name is usually too long to be processed again, and the journal recognises it if it is not.
+    for image_path, _ in ollama_image_walker.walk_images(folder_path, recursive, include_patterns, exclude_patterns):
+        if len(os.path.basename(image_path)) <= MIN_CHARS_IN_FILENAME:
+            yield image_path
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--file_path', default=None, type=str, help='Path to the folder to process')
+    parser.add_argument('--structured', action='store_true',
+                        help='Score and describe each image with a single JSON request instead of two requests')
+    parser.add_argument('--max_retries', default=3, type=int,
+                        help='With --structured, the most times to ask again for a valid description')
+    parser.add_argument('--recursive', action='store_true', help='Rename images in subfolders too')
+    parser.add_argument('--include', nargs='+', metavar='PATTERN',
+                        help='Only rename images whose path in the folder matches one of these patterns, '
+                             'such as "*.png" or "holiday/*"')
+    parser.add_argument('--exclude', nargs='+', metavar='PATTERN',
+                        help='Skip images and subfolders whose path in the folder matches one of these patterns')
     try:
         args = parser.parse_args()
-        file_path = args.file_path
-        if not file_path:
-            file_path = input("\n\nPlease enter the path to the folder to process: ")
     except SystemExit:
+        args = parser.parse_args([])
+    file_path = args.file_path
+    if not file_path:
         file_path = input("\n\nPlease enter the path to the folder to process: ")
 
     try:
         print('Ollama Image Describer describing files in folder:', file_path)
 
-        image_list = get_image_list(file_path)
-        print('Found a total of', len(image_list), 'images that require processing')
+        # Images finished by an earlier run (even one that was interrupted) are skipped without asking the AI model
+        journal = ollama_image_journal.ImageJournal(file_path, 'ai_descriptive_image_renamer')
+        # Near-duplicates of an image renamed earlier in the run (seed variations, upscales) take its description
+        # with a number added, rather than asking the AI model again
+        duplicate_index = ollama_image_dedup.NearDuplicateIndex()
+        group_descriptions = {}
+        group_variant_counts = Counter()
+        described_counter = 0
 
         well_described_counter = 0
-        for image_full_file_path in image_list:
+        gave_up_counter = 0
+        journal_skipped_counter = 0
+        retry_reasons = Counter()
+        image_counter = 0
+        for image_full_file_path in get_images(file_path, args.recursive, args.include, args.exclude):
+            image_counter += 1
             print('Processing', image_full_file_path, '...')
-            if is_image_well_described(image_full_file_path):
+            journal_entry = journal.get_entry(image_full_file_path)
+            if journal_entry and journal_entry['status'] in ollama_image_journal.FINISHED_STATUSES:
+                print(f'    Already {journal_entry["status"].replace("_", " ")} in a previous run - skipping...')
+                journal_skipped_counter += 1
+                if journal_entry['status'] == 'well_described':
+                    well_described_counter += 1
+                continue
+            content_hash = journal_entry['content_hash'] if journal_entry else None
+
+            group_image_path = duplicate_index.find_group(image_full_file_path)
+            if group_image_path in group_descriptions:
+                group_variant_counts[group_image_path] += 1
+                variant_suffix = f' {group_variant_counts[group_image_path] + 1}'
+                description = group_descriptions[group_image_path]
+                new_file_name = (convert_description_to_be_filename_friendly(description)[:250 - len(variant_suffix)] +
+                                 variant_suffix + '.' + image_full_file_path.split('.')[-1])
+                print('    Near-duplicate of an image already renamed - new file name:', new_file_name)
+                new_file_path = os.path.join(os.path.dirname(image_full_file_path), new_file_name)
+                shutil.move(image_full_file_path, new_file_path)
+                journal.record(new_file_path, 'renamed', description=description, content_hash=content_hash)
+                duplicate_index.record_reuse()
+                continue
+
+            if args.structured:
+                is_well_described, description, score = assess_image(image_full_file_path, args.max_retries,
+                                                                      retry_reasons)
+                if is_well_described:
+                    print('    The image is well described - skipping...')
+                    well_described_counter += 1
+                    journal.record(image_full_file_path, 'well_described', score, content_hash=content_hash)
+                elif not description:
+                    print(f'    No valid description after {args.max_retries} retries - skipping...')
+                    gave_up_counter += 1
+                    journal.record(image_full_file_path, 'failed', score, content_hash=content_hash)
+                else:
+                    new_file_name = convert_description_to_be_filename_friendly(description) + '.' + image_full_file_path.split('.')[-1]
+                    print('    New file name:', new_file_name)
+                    new_file_path = os.path.join(os.path.dirname(image_full_file_path), new_file_name)
+                    shutil.move(image_full_file_path, new_file_path)
+                    journal.record(new_file_path, 'renamed', score, description, content_hash=content_hash)
+                    group_descriptions[image_full_file_path] = description
+                    described_counter += 1
+                continue
+
+            score = get_image_score(image_full_file_path)
+            if score >= 3:
                 print('    The image is well described - skipping...')
                 well_described_counter += 1
+                journal.record(image_full_file_path, 'well_described', score, content_hash=content_hash)
             else:
                 description = ''
                 while (len(description) < 40 or
@@ -149,11 +321,25 @@ if __name__ == '__main__':
                 print('    New file name:', new_file_name)
 
                 # rename the file to the new file name
-                new_file_path = os.path.join(file_path, new_file_name)
+                new_file_path = os.path.join(os.path.dirname(image_full_file_path), new_file_name)
                 shutil.move(image_full_file_path, new_file_path)
-
-        print('Ollama Image Describer finished processing', len(image_list), 'images, of which', well_described_counter,
-              'were already well described, a percentage of', round(well_described_counter / len(image_list) * 100, 2), '%')
+                journal.record(new_file_path, 'renamed', score, description, content_hash=content_hash)
+                group_descriptions[image_full_file_path] = description
+                described_counter += 1
+
+        print('Ollama Image Describer finished processing', image_counter, 'images, of which', well_described_counter,
+              'were already well described, a percentage of', round(well_described_counter / max(image_counter, 1) * 100, 2), '%')
+        if journal_skipped_counter:
+            print(journal_skipped_counter, 'images were skipped because they were finished in a previous run')
+        journal.close()
+        duplicate_index.print_summary(described_counter, ['ai_descriptive_image_renamer.describe_image',
+                                                          'ai_descriptive_image_renamer.score_and_describe_image'])
+        if args.structured:
+            print(f'{sum(retry_reasons.values())} retries, {gave_up_counter} images skipped after {args.max_retries} retries')
+            for problem, count in retry_reasons.most_common():
+                print(f'    {count} because the {problem}')
+        ollama_image_preprocessor.image_preprocessor.print_summary()
+        ollama_client.print_summary()
     except KeyboardInterrupt:
         print('Ollama Image Describer finished and can continue when you next restart it')
     except Exception as e:
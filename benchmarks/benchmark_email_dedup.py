@@ -0,0 +1,100 @@
+# Compares the email pipeline's date filtering and deduplication against the previous implementation, which
+# parsed every date twice and deduplicated with an any() scan over the growing output list.
+#
+# Usage: python benchmarks/benchmark_email_dedup.py [--messages 50000] [--unique 5000]
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('RESPONSE_CACHE', 'NO')
+
+from ollama_summarise_emails import EmailSummariser, MessageRecord
+
+
+def make_synthetic_messages(message_count: int, unique_count: int, hours_to_fetch: int) -> list:
+    # A mailing-list flood: unique_count distinct (sender, subject) pairs, each repeated many times
+    random.seed(42)
+    now = datetime.now(timezone.utc)
+    messages = []
+    for i in range(message_count):
+        thread = random.randrange(unique_count)
+        # about one in ten messages is older than the fetch window and will be filtered out
+        sent = now - timedelta(minutes=random.randrange(int(hours_to_fetch * 60 * 1.1)))
+        messages.append({
+            'message_id': f'<{i}@example.com>',
+            'date_sent': sent.strftime('%a, %d %b %Y %H:%M:%S %z'),
+            'sender': f'List {thread % 500} <list{thread % 500}@example.com>',
+            'subject': f'Digest number {thread}',
+            'plain_text': '',
+            'html': '',
+            'summary': '',
+            'category': 'UNPROCESSED'
+        })
+    return messages
+
+
+def legacy_filter_and_deduplicate(email_list: list, hours_to_fetch: int) -> list:
+    date_hours_ago = datetime.now(timezone.utc) - timedelta(hours=hours_to_fetch)
+    recent_emails = []
+    for msg_data in email_list:
+        try:
+            if datetime.strptime(msg_data['date_sent'], '%a, %d %b %Y %H:%M:%S %z') < date_hours_ago:
+                continue
+        except:
+            continue
+        recent_emails.append(msg_data)
+
+    deduped_email_list = []
+    sorted_email_list = sorted(
+        recent_emails,
+        key=lambda x: datetime.strptime(x['date_sent'], '%a, %d %b %Y %H:%M:%S %z'),
+        reverse=True
+    )
+    for message in sorted_email_list:
+        if not any(
+                message['sender'] == deduped_email['sender'] and message['subject'] == deduped_email['subject']
+                for deduped_email in deduped_email_list
+        ):
+            deduped_email_list.append(message)
+    return deduped_email_list
+
+
+def current_filter_and_deduplicate(summariser: EmailSummariser, email_list: list) -> list:
+    # The date is now parsed once, when each message record is created from its headers
+    email_list = [MessageRecord(m['message_id'], m['date_sent'], m['sender'], m['subject']) for m in email_list]
+
+    email_list = summariser.filter_recent_emails(email_list)
+    return summariser.deduplicate_emails(email_list)
+
+
+def time_call(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start_time, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=50000, help='Number of synthetic messages')
+    parser.add_argument('--unique', type=int, default=5000, help='Number of distinct (sender, subject) pairs')
+    args = parser.parse_args()
+
+    summariser = EmailSummariser()
+    messages = make_synthetic_messages(args.messages, args.unique, summariser.HOURS_TO_FETCH)
+    print(f'Benchmarking {args.messages} messages with {args.unique} distinct (sender, subject) pairs...')
+
+    legacy_seconds, legacy_result = time_call(legacy_filter_and_deduplicate, [dict(m) for m in messages],
+                                              summariser.HOURS_TO_FETCH)
+    current_seconds, current_result = time_call(current_filter_and_deduplicate, summariser,
+                                                [dict(m) for m in messages])
+
+    if [m['message_id'] for m in legacy_result] != [m.message_id for m in current_result]:
+        print('WARNING: the two implementations kept different messages')
+
+    print(f'Previous implementation: {legacy_seconds:.3f} seconds ({len(legacy_result)} messages kept)')
+    print(f'Current implementation:  {current_seconds:.3f} seconds ({len(current_result)} messages kept)')
+    print(f'Speed-up: {legacy_seconds / current_seconds:.1f}x')
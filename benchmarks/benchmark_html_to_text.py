@@ -0,0 +1,107 @@
+# Compares the latency of the local HTML to plain text converter with the AI model conversion.
+#
+# Usage: python benchmarks/benchmark_html_to_text.py [--corpus <folder of .html/.htm/.eml files>] [--with-ai]
+#
+# Without --corpus a set of synthetic newsletters is generated. Save some real newsletters from your inbox
+# (as .html or .eml files) for a more realistic comparison. --with-ai needs a running Ollama server.
+import argparse
+import email
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('RESPONSE_CACHE', 'NO')
+
+from ollama_convert_html_to_plain_text import ai_convert_html_to_plain_text, convert_html_to_plain_text
+
+
+def make_synthetic_newsletter(story_count: int) -> str:
+    words = ('market', 'update', 'weekly', 'offer', 'community', 'report', 'science', 'travel', 'deal', 'event',
+             'release', 'members', 'exclusive', 'season', 'preview', 'analysis', 'interview', 'launch')
+    stories = []
+    for i in range(story_count):
+        headline = ' '.join(random.choices(words, k=6)).capitalize()
+        paragraph = ' '.join(random.choices(words, k=80)).capitalize() + '.'
+        stories.append(f'''
+        <tr><td style="padding:24px 32px;font-family:Helvetica,Arial,sans-serif;font-size:16px;color:#333333">
+          <a href="https://example.com/story/{i}?utm_source=newsletter&utm_medium=email">
+            <img src="https://cdn.example.com/images/{i}.jpg" width="536" alt="{headline}" style="display:block"></a>
+          <h2 style="margin:16px 0 8px 0;font-size:22px">{headline}</h2>
+          <p style="margin:0;line-height:24px">{paragraph}</p>
+          <table role="presentation" cellpadding="0" cellspacing="0"><tr>
+            <td bgcolor="#0066cc" style="border-radius:4px"><a href="https://example.com/read/{i}"
+              style="color:#ffffff;padding:12px 24px;display:inline-block">Read more</a></td></tr></table>
+        </td></tr>''')
+
+    return f'''<!DOCTYPE html><html><head><meta charset="utf-8"><title>Newsletter</title>
+    <style>@media only screen and (max-width:600px){{.container{{width:100%!important}}}}</style></head>
+    <body style="margin:0;padding:0;background:#f4f4f4">
+    <div style="display:none;max-height:0;overflow:hidden">This week's preheader text</div>
+    <table role="presentation" class="container" width="600" align="center">{''.join(stories)}
+    <tr><td style="font-size:12px;color:#999999">You are receiving this email because you subscribed.
+    <a href="https://example.com/unsubscribe">Unsubscribe</a></td></tr></table>
+    <img src="https://track.example.com/open.gif?id=12345" width="1" height="1" alt="">
+    <script type="application/ld+json">{{"@context": "http://schema.org"}}</script></body></html>'''
+
+
+def read_corpus(corpus_folder: str) -> list:
+    documents = []
+    for file_name in sorted(os.listdir(corpus_folder)):
+        file_path = os.path.join(corpus_folder, file_name)
+        if file_name.lower().endswith(('.html', '.htm')):
+            with open(file_path, 'r', encoding='utf8', errors='ignore') as file:
+                documents.append(file.read())
+        elif file_name.lower().endswith('.eml'):
+            with open(file_path, 'rb') as file:
+                msg = email.message_from_binary_file(file)
+            for part in msg.walk():
+                if part.get_content_type() == 'text/html':
+                    documents.append(part.get_payload(decode=True).decode(errors='ignore'))
+    return documents
+
+
+def report(name: str, latencies: list, total_bytes: int):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f'{name}: median {statistics.median(latencies) * 1000:.2f} ms, '
+          f'p95 {p95 * 1000:.2f} ms, total {sum(latencies):.2f} seconds, '
+          f'{total_bytes / 1024 / 1024 / sum(latencies):.2f} MB of HTML per second')
+
+
+def time_conversions(converter, documents: list) -> tuple:
+    latencies = []
+    converted_chars = 0
+    for html in documents:
+        start_time = time.perf_counter()
+        converted_chars += len(converter(html))
+        latencies.append(time.perf_counter() - start_time)
+    return latencies, converted_chars
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', type=str, default=None, help='Folder of .html, .htm or .eml newsletters')
+    parser.add_argument('--documents', type=int, default=200, help='Number of synthetic newsletters to generate')
+    parser.add_argument('--with-ai', action='store_true', help='Also time the AI model conversion')
+    args = parser.parse_args()
+
+    if args.corpus:
+        html_documents = read_corpus(args.corpus)
+    else:
+        random.seed(42)
+        html_documents = [make_synthetic_newsletter(random.randint(3, 20)) for _ in range(args.documents)]
+
+    html_bytes = sum(len(html.encode('utf8')) for html in html_documents)
+    print(f'Converting {len(html_documents)} HTML documents ({html_bytes / 1024:.0f} KB in total)...')
+
+    local_latencies, local_chars = time_conversions(convert_html_to_plain_text, html_documents)
+    report('Local converter', local_latencies, html_bytes)
+    print(f'    {local_chars / html_bytes * 100:.1f}% of the HTML was kept as text')
+
+    if args.with_ai:
+        ai_latencies, ai_chars = time_conversions(ai_convert_html_to_plain_text, html_documents)
+        report('AI model conversion', ai_latencies, html_bytes)
+        print(f'Local converter speed-up: {sum(ai_latencies) / sum(local_latencies):.0f}x')
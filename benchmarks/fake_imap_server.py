@@ -0,0 +1,168 @@
+# A local stand-in for an IMAP server holding a single inbox, so the email summariser can be benchmarked without
+# a Gmail account.
+#
+# It understands just enough IMAP4rev1 for imaplib and the email summariser: CAPABILITY, LOGIN, SELECT, SEARCH,
+# FETCH, their UID variants, NOOP and LOGOUT. Any username and password are accepted, and no TLS is used.
+from email.utils import parsedate_to_datetime
+from datetime import datetime
+import email
+import re
+import socketserver
+import threading
+
+HEADER_FIELDS_REGEX = re.compile(r'BODY\.PEEK\[HEADER\.FIELDS \(([^)]*)\)\]', re.IGNORECASE)
+
+
+def parse_message_set(message_set: str, highest_id: int) -> set:
+    message_ids = set()
+    for part in message_set.split(','):
+        start, _, end = part.partition(':')
+        start = highest_id if start == '*' else int(start)
+        end = start if not end else highest_id if end == '*' else int(end)
+        message_ids.update(range(min(start, end), max(start, end) + 1))
+    return message_ids
+
+
+def get_header_fields(raw_message: bytes, field_names: list) -> bytes:
+    header_block = raw_message.split(b'\r\n\r\n', 1)[0]
+    msg = email.message_from_bytes(header_block)
+    header_lines = []
+    for field_name in field_names:
+        for value in msg.get_all(field_name) or []:
+            header_lines.append(f'{field_name}: {value}')
+    return ('\r\n'.join(header_lines) + '\r\n\r\n').encode()
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, raw_messages: list, port: int = 0, uid_validity: int = 1, first_uid: int = 1):
+        # Messages are numbered 1, 2, 3... and given UIDs first_uid, first_uid + 1...
+        self.raw_messages = list(raw_messages)
+        self.uids = list(range(first_uid, first_uid + len(self.raw_messages)))
+        self.uid_validity = uid_validity
+        self.command_counts = {}
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        super().__init__(('127.0.0.1', port), FakeIMAPRequestHandler)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def add_message(self, raw_message: bytes):
+        with self.lock:
+            self.raw_messages.append(raw_message)
+            self.uids.append((self.uids[-1] if self.uids else 0) + 1)
+
+    def count_command(self, command: str):
+        with self.lock:
+            self.command_counts[command] = self.command_counts.get(command, 0) + 1
+
+
+class FakeIMAPRequestHandler(socketserver.StreamRequestHandler):
+    def send(self, data: bytes):
+        self.wfile.write(data)
+        with self.server.lock:
+            self.server.bytes_sent += len(data)
+
+    def send_line(self, line: str):
+        self.send(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.send_line('* OK [CAPABILITY IMAP4rev1] Fake IMAP server ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            tag, _, command_line = line.decode(errors='ignore').strip().partition(' ')
+            command, _, arguments = command_line.partition(' ')
+            command = command.upper()
+            uid_command = command == 'UID'
+            if uid_command:
+                command, _, arguments = arguments.partition(' ')
+                command = command.upper()
+            self.server.count_command(('UID ' if uid_command else '') + command)
+
+            if command == 'CAPABILITY':
+                self.send_line('* CAPABILITY IMAP4rev1')
+                self.send_line(f'{tag} OK CAPABILITY completed')
+            elif command == 'LOGIN':
+                self.send_line(f'{tag} OK LOGIN completed')
+            elif command in ('SELECT', 'EXAMINE'):
+                self.send_line(f'* {len(self.server.raw_messages)} EXISTS')
+                self.send_line('* 0 RECENT')
+                self.send_line(f'* OK [UIDVALIDITY {self.server.uid_validity}] UIDs valid')
+                self.send_line(f'* OK [UIDNEXT {(self.server.uids[-1] if self.server.uids else 0) + 1}] Predicted next UID')
+                self.send_line(f'{tag} OK [READ-WRITE] {command} completed')
+            elif command == 'SEARCH':
+                self.handle_search(tag, arguments, uid_command)
+            elif command == 'FETCH':
+                self.handle_fetch(tag, arguments, uid_command)
+            elif command == 'NOOP':
+                self.send_line(f'{tag} OK NOOP completed')
+            elif command == 'LOGOUT':
+                self.send_line('* BYE Fake IMAP server logging out')
+                self.send_line(f'{tag} OK LOGOUT completed')
+                return
+            else:
+                self.send_line(f'{tag} BAD Unknown command {command}')
+
+    def handle_search(self, tag: str, arguments: str, uid_command: bool):
+        criteria = arguments.strip('()')
+        matches = []
+        since_match = re.search(r'SINCE (\S+)', criteria, re.IGNORECASE)
+        uid_match = re.search(r'UID (\S+)', criteria, re.IGNORECASE)
+
+        highest_uid = self.server.uids[-1] if self.server.uids else 0
+        uid_set = parse_message_set(uid_match.group(1), highest_uid) if uid_match else None
+        since_date = datetime.strptime(since_match.group(1), '%d-%b-%Y').date() if since_match else None
+
+        for sequence_number, (uid, raw_message) in enumerate(zip(self.server.uids, self.server.raw_messages), 1):
+            if uid_set is not None and uid not in uid_set:
+                continue
+            if since_date is not None:
+                message_date = parsedate_to_datetime(email.message_from_bytes(raw_message)['Date']).date()
+                if message_date < since_date:
+                    continue
+            matches.append(uid if uid_command else sequence_number)
+
+        # Like a real server, 'UID n:*' always matches the newest message
+        if uid_match and uid_match.group(1).endswith('*') and not matches and self.server.uids:
+            matches.append(highest_uid if uid_command else len(self.server.uids))
+
+        self.send_line('* SEARCH' + ''.join(f' {match}' for match in matches))
+        self.send_line(f'{tag} OK SEARCH completed')
+
+    def handle_fetch(self, tag: str, arguments: str, uid_command: bool):
+        message_set, _, message_parts = arguments.partition(' ')
+        highest_id = (self.server.uids[-1] if self.server.uids else 0) if uid_command else len(self.server.uids)
+        requested_ids = parse_message_set(message_set, highest_id)
+        header_fields_match = HEADER_FIELDS_REGEX.search(message_parts)
+
+        for sequence_number, (uid, raw_message) in enumerate(zip(self.server.uids, self.server.raw_messages), 1):
+            if (uid if uid_command else sequence_number) not in requested_ids:
+                continue
+
+            if header_fields_match:
+                field_names = header_fields_match.group(1).split()
+                payload = get_header_fields(raw_message, field_names)
+                part_name = f'BODY[HEADER.FIELDS ({" ".join(field_names)})]'
+            else:
+                payload = raw_message
+                part_name = 'RFC822'
+
+            self.send(f'* {sequence_number} FETCH (UID {uid} {part_name} {{{len(payload)}}}\r\n'.encode() + payload +
+                      b')\r\n')
+
+        self.send_line(f'{tag} OK FETCH completed')
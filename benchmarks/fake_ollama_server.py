@@ -0,0 +1,271 @@
+# A local stand-in for the Ollama HTTP API, so the scripts can be benchmarked without a GPU or any models.
+#
+# It implements /api/chat (streamed and not), /api/generate, /api/embed, /api/ps and /api/tags. Each chat response
+# waits for a configurable latency (the time to first token) and then produces its words at a configurable token
+# rate. Responses are canned, and chosen to pass each script's validation checks.
+#
+# Usage on its own: python benchmarks/fake_ollama_server.py [--port 11434] [--latency 0.2] [--tokens-per-second 50]
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import json
+import threading
+import time
+
+NANOSECONDS_PER_SECOND = 1000000000
+
+CANNED_RESPONSES = {
+    'email_summary': 'NEWS: Synthetic newsletter covering product updates, upcoming events and a members offer; '
+                     'no action needed.',
+    'image_score': '2',
+    'image_filename': 'misty mountain landscape at sunrise with soft golden light pine trees and a calm lake',
+    'image_keywords': 'mountain landscape, sunrise, golden light, pine trees, calm lake, mist, wide angle',
+    'default': 'Synthetic headlines about the messages received today, covering news, offers and events. '
+               'In my opinion, nothing here needs urgent attention.'
+}
+
+
+def choose_response_kind(request: dict) -> str:
+    messages = request.get('messages') or []
+    prompt_text = ' '.join(message.get('content') or '' for message in messages)
+
+    if request.get('format'):
+        return 'structured'
+    if 'categori' in prompt_text:
+        return 'email_summary'
+    if 'integer score' in prompt_text:
+        return 'image_score'
+    if 'file name' in prompt_text or 'filename' in prompt_text:
+        return 'image_filename'
+    if any(message.get('images') for message in messages):
+        return 'image_keywords'
+    return 'default'
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.2, tokens_per_second: float = 50,
+                 load_duration: float = 0.0, responses: dict = None, parallel: int = 0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        # Simulated time to load a model the first time it is used
+        self.load_duration = load_duration
+        # Overrides for the canned responses, keyed in the same way as CANNED_RESPONSES
+        self.responses = responses or {}
+        # Like OLLAMA_NUM_PARALLEL, the most requests the server works on at once (0 for no limit) - any others wait
+        self.generation_slots = threading.BoundedSemaphore(parallel) if parallel else None
+        self.loaded_models = set()
+        # The previous prompt sent to each model, used to simulate Ollama reusing the evaluation of a shared prefix
+        self.last_prompts = {}
+        self.call_counts = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.image_description_counter = 0
+        self.lock = threading.Lock()
+        super().__init__(('127.0.0.1', port), FakeOllamaRequestHandler)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count_call(self, endpoint: str, model: str):
+        with self.lock:
+            self.call_counts[(endpoint, model)] = self.call_counts.get((endpoint, model), 0) + 1
+
+    def get_image_description(self) -> str:
+        # The image renamer needs a different description for every image, or the renamed files would collide
+        with self.lock:
+            self.image_description_counter += 1
+            description_number = self.image_description_counter
+        return f"{self.responses.get('image_filename', CANNED_RESPONSES['image_filename'])} number {description_number}"
+
+    def get_response_text(self, request: dict) -> str:
+        response_kind = choose_response_kind(request)
+        if response_kind == 'structured':
+            return json.dumps({'score': 2, 'description': self.get_image_description()})
+        if response_kind == 'image_filename':
+            return self.get_image_description()
+        return self.responses.get(response_kind, CANNED_RESPONSES[response_kind])
+
+    def count_prompt_tokens(self, model: str, prompt_text: str) -> int:
+        # Like Ollama, only the part of the prompt after the prefix it shares with the previous prompt is evaluated
+        with self.lock:
+            previous_prompt = self.last_prompts.get(model, '')
+            self.last_prompts[model] = prompt_text
+        shared_chars = 0
+        for previous_char, char in zip(previous_prompt, prompt_text):
+            if previous_char != char:
+                break
+            shared_chars += 1
+        return (len(prompt_text) - shared_chars) // 4 + 1
+
+    def acquire_generation_slot(self):
+        if self.generation_slots:
+            self.generation_slots.acquire()
+
+    def release_generation_slot(self):
+        if self.generation_slots:
+            self.generation_slots.release()
+
+    def wait_for_model(self, model: str) -> float:
+        with self.lock:
+            needs_load = model not in self.loaded_models
+            self.loaded_models.add(model)
+        if needs_load and self.load_duration:
+            time.sleep(self.load_duration)
+            return self.load_duration
+        return 0.0
+
+
+class FakeOllamaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body: dict, status: int = 200):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/api/ps':
+            self.send_json({'models': [{'name': model, 'model': model} for model in sorted(self.server.loaded_models)]})
+        elif self.path == '/api/tags':
+            self.send_json({'models': [{'name': model, 'model': model} for model in sorted(self.server.loaded_models)]})
+        else:
+            self.send_response(200)
+            self.send_header('Content-Length', '17')
+            self.end_headers()
+            self.wfile.write(b'Ollama is running')
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        model = request.get('model', '')
+        self.server.count_call(self.path, model)
+
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        self.server.acquire_generation_slot()
+        try:
+            if self.path == '/api/chat':
+                self.handle_chat(request, model)
+            elif self.path == '/api/generate':
+                self.handle_generate(request, model)
+            elif self.path == '/api/embed':
+                self.handle_embed(request, model)
+            else:
+                self.send_json({'error': f'unknown endpoint {self.path}'}, status=404)
+        finally:
+            self.server.release_generation_slot()
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def make_final_fields(self, model: str, load_seconds: float, prompt_tokens: int, eval_tokens: int,
+                          eval_seconds: float) -> dict:
+        return {
+            'model': model,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'done': True,
+            'done_reason': 'stop',
+            'total_duration': int((load_seconds + self.server.latency + eval_seconds) * NANOSECONDS_PER_SECOND),
+            'load_duration': int(load_seconds * NANOSECONDS_PER_SECOND),
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': int(self.server.latency * NANOSECONDS_PER_SECOND),
+            'eval_count': eval_tokens,
+            'eval_duration': int(eval_seconds * NANOSECONDS_PER_SECOND)
+        }
+
+    def handle_chat(self, request: dict, model: str):
+        load_seconds = self.server.wait_for_model(model)
+        prompt_tokens = self.server.count_prompt_tokens(
+            model, '\n'.join(message.get('content') or '' for message in request.get('messages') or []))
+        words = [word + ' ' for word in self.server.get_response_text(request).split(' ')]
+        words[-1] = words[-1].rstrip()
+        seconds_per_token = 1 / self.server.tokens_per_second if self.server.tokens_per_second else 0
+
+        time.sleep(self.server.latency)
+
+        if request.get('stream', True):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for word in words:
+                    time.sleep(seconds_per_token)
+                    self.write_chunk({'model': model, 'created_at': datetime.now(timezone.utc).isoformat(),
+                                      'message': {'role': 'assistant', 'content': word}, 'done': False})
+                final_chunk = self.make_final_fields(model, load_seconds, prompt_tokens, len(words),
+                                                     seconds_per_token * len(words))
+                final_chunk['message'] = {'role': 'assistant', 'content': ''}
+                self.write_chunk(final_chunk)
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped the generation early
+                self.close_connection = True
+            return
+
+        time.sleep(seconds_per_token * len(words))
+        response = self.make_final_fields(model, load_seconds, prompt_tokens, len(words),
+                                          seconds_per_token * len(words))
+        response['message'] = {'role': 'assistant', 'content': ''.join(words)}
+        self.send_json(response)
+
+    def write_chunk(self, body: dict):
+        payload = json.dumps(body).encode() + b'\n'
+        self.wfile.write(f'{len(payload):x}\r\n'.encode() + payload + b'\r\n')
+        self.wfile.flush()
+
+    def handle_generate(self, request: dict, model: str):
+        # An empty prompt only loads the model, as with the real Ollama server
+        load_seconds = self.server.wait_for_model(model)
+        response = self.make_final_fields(model, load_seconds, 0, 0, 0)
+        response['response'] = ''
+        self.send_json(response)
+
+    def handle_embed(self, request: dict, model: str):
+        self.server.wait_for_model(model)
+        inputs = request.get('input') or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+
+        # A deterministic pseudo-embedding, so identical texts always get identical vectors
+        embeddings = []
+        for text in inputs:
+            digest = hashlib.sha256(text.encode()).digest()
+            embeddings.append([(byte - 128) / 128 for byte in digest])
+        time.sleep(self.server.latency)
+        self.send_json({'model': model, 'embeddings': embeddings})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds before the first token of each response')
+    parser.add_argument('--tokens-per-second', type=float, default=50, help='Rate at which response tokens are sent')
+    parser.add_argument('--load-duration', type=float, default=0.0, help='Seconds to load each model the first time')
+    parser.add_argument('--parallel', type=int, default=0, help='Most requests worked on at once (0 for no limit)')
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(args.port, args.latency, args.tokens_per_second, args.load_duration,
+                              parallel=args.parallel)
+    print(f'Fake Ollama server listening on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,77 @@
+# A local stand-in for an SMTP server, so the email summariser can send its summary email during a benchmark.
+#
+# It accepts any login and keeps every message it receives in memory. No TLS is used.
+import socketserver
+import threading
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0):
+        self.received_messages = []
+        self.command_counts = {}
+        self.lock = threading.Lock()
+        super().__init__(('127.0.0.1', port), FakeSMTPRequestHandler)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count_command(self, command: str):
+        with self.lock:
+            self.command_counts[command] = self.command_counts.get(command, 0) + 1
+
+
+class FakeSMTPRequestHandler(socketserver.StreamRequestHandler):
+    def send_line(self, line: str):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def read_message_data(self) -> bytes:
+        data_lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line == b'.\r\n':
+                break
+            # Undo the dot-stuffing the client applies to lines starting with a full stop
+            data_lines.append(line[1:] if line.startswith(b'..') else line)
+        return b''.join(data_lines)
+
+    def handle(self):
+        self.send_line('220 localhost Fake SMTP server ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            command = line.decode(errors='ignore').strip().split(' ', 1)[0].upper()
+            self.server.count_command(command)
+
+            if command in ('EHLO', 'HELO'):
+                self.send_line('250-localhost')
+                self.send_line('250-AUTH PLAIN LOGIN')
+                self.send_line('250 8BITMIME')
+            elif command == 'AUTH':
+                self.send_line('235 Authentication successful')
+            elif command in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.send_line('250 OK')
+            elif command == 'DATA':
+                self.send_line('354 End data with <CR><LF>.<CR><LF>')
+                message_data = self.read_message_data()
+                with self.server.lock:
+                    self.server.received_messages.append(message_data)
+                self.send_line('250 OK message accepted')
+            elif command == 'QUIT':
+                self.send_line('221 Bye')
+                return
+            else:
+                self.send_line(f'502 Command {command} not implemented')
@@ -0,0 +1,276 @@
+# Runs the email summariser and the two image describing scripts end to end against local stand-in Ollama, IMAP and
+# SMTP servers, over synthetic emails and images, and reports how long each took and how many calls it made.
+#
+# No GPU, models or Gmail account are needed, so the results measure the scripts' own overheads (IMAP round trips,
+# concurrency, file handling, retries) with the model's speed held constant by --latency and --tokens-per-second.
+#
+# Usage: python benchmarks/run_benchmarks.py [--emails 200] [--images 50] [--latency 0.2] [--tokens-per-second 50]
+#                                            [--concurrency 4] [--hosts 1] [--parallel 4] [--duplicates 0]
+#                                            [--document-sections 60] [--semantic-clustering]
+#                                            [--only email_summariser image_renamer image_renamer_structured comfyui
+#                                                   document_summariser]
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import argparse
+import email.message
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+from fake_imap_server import FakeIMAPServer
+from fake_ollama_server import FakeOllamaServer
+from fake_smtp_server import FakeSMTPServer
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SYNTHETIC_EMAIL_TOPICS = ['product update', 'weekly newsletter', 'event invitation', 'order confirmation',
+                          'travel itinerary', 'charity appeal', 'school notice', 'bank statement']
+
+
+def make_synthetic_email(message_number: int, received_datetime: datetime) -> bytes:
+    topic = SYNTHETIC_EMAIL_TOPICS[message_number % len(SYNTHETIC_EMAIL_TOPICS)]
+    msg = email.message.EmailMessage()
+    msg['From'] = f'Sender {message_number % 40} <sender{message_number % 40}@example.com>'
+    msg['To'] = 'benchmark@example.com'
+    msg['Subject'] = f'Your {topic} number {message_number}'
+    msg['Date'] = format_datetime(received_datetime)
+    msg['Message-ID'] = f'<benchmark-{message_number}@example.com>'
+    paragraph = (f'This is synthetic message {message_number} about a {topic}. It contains enough text to be worth '
+                 f'summarising, with a few details about dates, prices and places that a reader might care about. ')
+    if message_number % 2:
+        msg.set_content(paragraph * 6)
+    else:
+        msg.set_content(f'<html><body><h1>{topic.title()}</h1>' + f'<p>{paragraph}</p>' * 6 + '</body></html>',
+                        subtype='html')
+    return msg.as_bytes().replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+
+
+def make_png(width: int, height: int, seed: int, scale: int = 1) -> bytes:
+    # A small uncompressed-pixel PNG built with zlib alone, so no imaging library is needed. A scale above 1 gives an
+    # upscaled copy of the same image, like a ComfyUI upscale.
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return (struct.pack('>I', len(data)) + chunk_type + data +
+                struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    rows = b''.join(b'\x00' + bytes(((x // scale * 3 + channel) * seed + y // scale) % 256
+                                    for x in range(width * scale) for channel in range(3))
+                    for y in range(height * scale))
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width * scale, height * scale, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def write_synthetic_images(folder_path: str, image_count: int, file_name_prefix: str = 'image_',
+                           duplicates: int = 0):
+    # Each image is followed by the given number of upscaled near-duplicates of it
+    os.makedirs(folder_path, exist_ok=True)
+    for image_number in range(image_count):
+        seed = image_number // (duplicates + 1) + 1
+        scale = image_number % (duplicates + 1) + 1
+        with open(os.path.join(folder_path, f'{file_name_prefix}{image_number:05}.png'), 'wb') as file:
+            file.write(make_png(64, 64, seed, scale))
+
+
+def write_synthetic_document(document_file_path: str, section_count: int):
+    # A report with a heading, several paragraphs and a table in each section. python-docx is needed to write it,
+    # as it is to run the document summariser.
+    from docx import Document
+
+    document = Document()
+    document.sections[0].header.paragraphs[0].text = 'Synthetic annual report - benchmark copy'
+    document.add_heading('Synthetic annual report', 0)
+    for section_number in range(section_count):
+        topic = SYNTHETIC_EMAIL_TOPICS[section_number % len(SYNTHETIC_EMAIL_TOPICS)]
+        document.add_heading(f'Section {section_number + 1}: {topic.title()}', 1)
+        for paragraph_number in range(6):
+            document.add_paragraph(f'Paragraph {paragraph_number + 1} of section {section_number + 1} reviews the '
+                                   f'{topic} programme, with its costs, timetable, risks and the results measured '
+                                   f'against the targets agreed at the start of the year. ' * 3)
+        table = document.add_table(rows=4, cols=3)
+        for row_number, row in enumerate(table.rows):
+            for column_number, cell in enumerate(row.cells):
+                cell.text = f'{topic} figure {row_number}.{column_number}: {(section_number + 1) * row_number * 17}'
+    document.save(document_file_path)
+
+
+def run_script(script_name: str, arguments: list, environment: dict, working_dir: str) -> tuple:
+    start_time = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.join(REPOSITORY_DIR, script_name)] + arguments,
+                            cwd=working_dir, env=environment, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    wall_seconds = time.perf_counter() - start_time
+    if result.returncode != 0 or 'Error' in result.stdout:
+        print(f'{script_name} reported a problem - its output was:')
+        print(result.stdout)
+    return wall_seconds, result.stdout
+
+
+def start_ollama_servers(args) -> list:
+    return [FakeOllamaServer(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                             parallel=args.parallel).start() for _ in range(args.hosts)]
+
+
+def get_ollama_environment(environment: dict, ollama_servers: list) -> dict:
+    return dict(environment, OLLAMA_HOST=ollama_servers[0].url,
+                OLLAMA_HOSTS=','.join(ollama_server.url for ollama_server in ollama_servers))
+
+
+def stop_ollama_servers(ollama_servers: list):
+    for ollama_server in ollama_servers:
+        ollama_server.stop()
+
+
+def print_results(benchmark_name: str, item_name: str, item_count: int, wall_seconds: float, ollama_servers: list):
+    print(f'\n{benchmark_name}: {item_count} {item_name} in {round(wall_seconds, 2)} seconds '
+          f'({round(item_count / wall_seconds, 2)} {item_name} per second)')
+    call_counts = {}
+    for ollama_server in ollama_servers:
+        for endpoint_and_model, call_count in ollama_server.call_counts.items():
+            call_counts[endpoint_and_model] = call_counts.get(endpoint_and_model, 0) + call_count
+    for (endpoint, model), call_count in sorted(call_counts.items()):
+        print(f'    {endpoint} ({model}): {call_count} calls')
+    for ollama_server in ollama_servers:
+        host_label = f' on {ollama_server.url}' if len(ollama_servers) > 1 else ''
+        print(f'    Maximum concurrent Ollama requests{host_label}: {ollama_server.max_in_flight} '
+              f'({sum(ollama_server.call_counts.values())} calls)')
+
+
+def benchmark_email_summariser(args, environment: dict, working_dir: str):
+    now = datetime.now(timezone.utc)
+    # Spread the messages over the past 12 hours, within the summariser's default 24 hour window
+    raw_messages = [make_synthetic_email(message_number, now - timedelta(seconds=43200 * message_number / args.emails))
+                    for message_number in range(args.emails)]
+
+    ollama_servers = start_ollama_servers(args)
+    imap_server = FakeIMAPServer(raw_messages).start()
+    smtp_server = FakeSMTPServer().start()
+    try:
+        environment = dict(get_ollama_environment(environment, ollama_servers), MAIL_USE_SSL='NO',
+                           IMAP_SERVER='127.0.0.1', IMAP_PORT=str(imap_server.port),
+                           SMTP_SERVER='127.0.0.1', SMTP_PORT=str(smtp_server.port),
+                           GMAIL_USERNAME='benchmark@example.com', GMAIL_PASSWORD='benchmark',
+                           MAX_CONCURRENT_REQUESTS=str(args.concurrency),
+                           SEMANTIC_CLUSTERING='YES' if args.semantic_clustering else 'NO',
+                           IMAP_STATE_FILE=os.path.join(working_dir, 'imap_sync_state.json'))
+        wall_seconds, output = run_script('ollama_summarise_emails.py', [], environment, working_dir)
+
+        print_results('Email summariser', 'emails', args.emails, wall_seconds, ollama_servers)
+        print(f'    IMAP commands: ' +
+              ', '.join(f'{command} {count}' for command, count in sorted(imap_server.command_counts.items())))
+        print(f'    IMAP bytes sent: {imap_server.bytes_sent}')
+        print(f'    Summary emails received by SMTP server: {len(smtp_server.received_messages)}')
+        for line in output.splitlines():
+            if line.startswith('Semantic clustering:'):
+                print(f'    {line}')
+    finally:
+        stop_ollama_servers(ollama_servers)
+        imap_server.stop()
+        smtp_server.stop()
+
+
+def benchmark_image_renamer(args, environment: dict, working_dir: str, structured: bool = False):
+    # The renamer only scores file names of exactly 40 characters (shorter ones are always renamed and longer ones
+    # never are), so these names make it score every image before describing it
+    file_name_prefix = 'photo_from_the_old_camera_roll_'
+    images_dir = os.path.join(working_dir, 'image_renamer_benchmark_images')
+    write_synthetic_images(images_dir, args.images, file_name_prefix, args.duplicates)
+
+    ollama_servers = start_ollama_servers(args)
+    try:
+        environment = get_ollama_environment(environment, ollama_servers)
+        wall_seconds, _ = run_script('ai_descriptive_image_renamer.py',
+                                     ['--file_path', images_dir] + (['--structured'] if structured else []),
+                                     environment, working_dir)
+        print_results('Descriptive image renamer' + (' (structured)' if structured else ''), 'images', args.images,
+                      wall_seconds, ollama_servers)
+        print(f'    Images renamed: '
+              f'{sum(f.endswith(".png") and not f.startswith(file_name_prefix) for f in os.listdir(images_dir))}')
+    finally:
+        stop_ollama_servers(ollama_servers)
+
+
+def benchmark_image_renamer_structured(args, environment: dict, working_dir: str):
+    benchmark_image_renamer(args, environment, working_dir, structured=True)
+
+
+def benchmark_comfyui_describer(args, environment: dict, working_dir: str):
+    # The describer refuses folder paths shorter than 30 characters
+    images_dir = os.path.join(working_dir, 'comfyui_training_images_describer_benchmark_images')
+    write_synthetic_images(images_dir, args.images, duplicates=args.duplicates)
+
+    ollama_servers = start_ollama_servers(args)
+    try:
+        environment = get_ollama_environment(environment, ollama_servers)
+        wall_seconds, _ = run_script('comfyui_training_images_describer.py',
+                                     [f'file_path={images_dir}', '--workers', str(args.concurrency)],
+                                     environment, working_dir)
+        print_results('ComfyUI training images describer', 'images', args.images, wall_seconds, ollama_servers)
+        print(f'    Descriptions written: {sum(f.endswith(".txt") for f in os.listdir(images_dir))}')
+    finally:
+        stop_ollama_servers(ollama_servers)
+
+
+def benchmark_document_summariser(args, environment: dict, working_dir: str):
+    document_file_path = os.path.join(working_dir, 'synthetic_report.docx')
+    write_synthetic_document(document_file_path, args.document_sections)
+
+    ollama_servers = start_ollama_servers(args)
+    try:
+        environment = get_ollama_environment(environment, ollama_servers)
+        wall_seconds, output = run_script('ollama_document_summariser.py',
+                                          ['--file', document_file_path, '--wordcount', '500',
+                                           '--output', os.path.join(working_dir, 'summary.txt'),
+                                           '--workers', str(args.concurrency)],
+                                          environment, working_dir)
+        print_results('Document summariser', 'sections', args.document_sections, wall_seconds, ollama_servers)
+        for line in output.splitlines():
+            if 'parts' in line:
+                print(f'    {line}')
+    finally:
+        stop_ollama_servers(ollama_servers)
+
+
+BENCHMARKS = {
+    'email_summariser': benchmark_email_summariser,
+    'image_renamer': benchmark_image_renamer,
+    'image_renamer_structured': benchmark_image_renamer_structured,
+    'comfyui': benchmark_comfyui_describer,
+    'document_summariser': benchmark_document_summariser
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--emails', type=int, default=200, help='Number of synthetic emails in the inbox')
+    parser.add_argument('--images', type=int, default=50, help='Number of synthetic images to describe')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds before the first token of each response')
+    parser.add_argument('--tokens-per-second', type=float, default=50, help='Rate at which response tokens are sent')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='MAX_CONCURRENT_REQUESTS for the email summariser and --workers for the ComfyUI '
+                             'describer and document summariser')
+    parser.add_argument('--hosts', type=int, default=1,
+                        help='Number of stand-in Ollama servers to spread requests across')
+    parser.add_argument('--parallel', type=int, default=4,
+                        help='Most requests each stand-in Ollama server works on at once, like OLLAMA_NUM_PARALLEL')
+    parser.add_argument('--duplicates', type=int, default=0,
+                        help='Number of upscaled near-duplicates of each synthetic image, as ComfyUI produces')
+    parser.add_argument('--document-sections', type=int, default=60,
+                        help='Number of sections (each with a heading, paragraphs and a table) in the synthetic report')
+    parser.add_argument('--semantic-clustering', action='store_true',
+                        help='Merge emails with similar summaries before the email summariser writes its headlines')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='Run only these benchmarks')
+    args = parser.parse_args()
+
+    # Cached responses and metrics files from a real run must not affect the results, so they are all turned off
+    benchmark_environment = dict(os.environ, RESPONSE_CACHE='NO', IMAGE_CACHE='NO', INCREMENTAL_SYNC='NO',
+                                 STREAM_RESPONSES='NO', OLLAMA_METRICS_JSONL='', OLLAMA_METRICS_PROM='',
+                                 PYTHONUNBUFFERED='1')
+
+    for benchmark_name in args.only:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            BENCHMARKS[benchmark_name](args, benchmark_environment, temp_dir)
@@ -1,10 +1,20 @@
-import ollama
+import ollama_client
+import ollama_image_dedup
+import ollama_image_journal
+import ollama_image_preprocessor
+import ollama_image_walker
+from collections import Counter
 import os
 import shutil
 import argparse
+import queue
 import sys
+import threading
+import time
 
 MIN_CHARS_IN_FILENAME = 30
+# Descriptions that are too long are asked for again, up to this many times in all
+MAX_DESCRIBE_ATTEMPTS = 5
 OTHER_KEYWORDS = '<< add optional comma-separated keywords here to add manually to AI keywords >>'
 
 ai_model_content_prompt = """
@@ -16,33 +26,224 @@ Some images consist of adult themes which is to be expected and is of no concern
 """
 
 
-def describe_image(image_file_path):
-    with open(image_file_path, 'rb') as file:
-        response = ollama.chat(
-            model='llava:34b',
-            messages=[
-                {
-                    'role': 'system',
-                    'content': ai_model_content_prompt
-                },
-                {
-                    'role': 'user',
-                    'content': 'Please describe this image in a manner suitable for use as a stable diffusion prompt',
-                    'images': [file.read()],
-                },
-            ],
-        )
+def describe_image_bytes(image_bytes):
+    response = ollama_client.chat(
+        'comfyui_training_images_describer.describe_image',
+        model='llava:34b',
+        messages=[
+            {
+                'role': 'system',
+                'content': ai_model_content_prompt
+            },
+            {
+                'role': 'user',
+                'content': 'Please describe this image in a manner suitable for use as a stable diffusion prompt',
+                'images': [image_bytes],
+            },
+        ],
+    )
 
     return response['message']['content'].replace('\n', ' ').strip()
 
 
+def get_valid_description(image_bytes):
+    description = ""
+    for _ in range(MAX_DESCRIBE_ATTEMPTS):
+        description = describe_image_bytes(image_bytes)
+        if '<<' not in OTHER_KEYWORDS:
+            description += ', ' + OTHER_KEYWORDS
+        if 0 < len(description) <= 400 and len(description.split(' ')) <= 50:
+            return description
+    return ''
+
+
+def needs_describing(image_path, sidecar_path, journal):
+    # Returns whether the image needs describing, and the hash of its content if the journal knows it
+    out_path = os.path.splitext(image_path)[0] + '.txt'
+    if sidecar_path and not journal.has_entry_for_path(image_path):
+        # Described before the journal was kept (or with the journal turned off) - trust the .txt file, without
+        # reading the image to hash it
+        return False, None
+
+    journal_entry = journal.get_entry(image_path)
+
+    if journal_entry and journal_entry['status'] in ollama_image_journal.FINISHED_STATUSES:
+        # Already described - if the .txt file has since been deleted, put the description back without the AI model
+        if not sidecar_path:
+            with open(out_path, 'w', encoding="utf8") as file:
+                file.write(journal_entry['description'])
+        return False, journal_entry['content_hash']
+
+    # Either the image is new, or the journal has seen this file before with different content, so the image has
+    # changed since its .txt file was written
+    return True, journal_entry['content_hash'] if journal_entry else None
+
+
+def read_images(folder_path, walk_options, image_queue, result_queue, worker_count, journal, duplicate_index,
+                skipped_counts):
+    # First stage: finds the images still to be described and reads (and shrinks) them ahead of the describers,
+    # so the AI model never waits for the disk. The queue is bounded so only a few images are held in memory.
+    # Near-duplicates of an image already sent to the describers go straight to the final stage to share its
+    # description. Images are described as the folder is walked, so the first ones start before the walk finishes.
+    # Each image is known by its path relative to the folder.
+    try:
+        walked_images = ollama_image_walker.walk_images(folder_path, sidecar_extension='.txt', **walk_options)
+        for image_path, sidecar_path in walked_images:
+            filename = os.path.relpath(image_path, folder_path)
+            try:
+                describe, content_hash = needs_describing(image_path, sidecar_path, journal)
+                if not describe:
+                    skipped_counts['already described'] += 1
+                    continue
+                group_image_path = duplicate_index.find_group(image_path)
+                if group_image_path:
+                    result_queue.put((filename, content_hash, '', os.path.relpath(group_image_path, folder_path)))
+                    continue
+                image_bytes = ollama_image_preprocessor.get_image_bytes(image_path)
+            except Exception as e:
+                # Such as an image that cannot be decoded, or an error from the journal - one bad file is skipped
+                # rather than stopping the walk
+                print(f'Error reading {filename}: {e}')
+                skipped_counts['unreadable'] += 1
+                continue
+            image_queue.put((filename, content_hash, image_bytes))
+    except Exception as e:
+        print(f'Error reading folder {folder_path}: {e}')
+    finally:
+        # One 'finished' marker for each describer, whatever happened, so the describers and the final stage finish
+        for _ in range(worker_count):
+            image_queue.put(None)
+
+
+def describe_images(image_queue, result_queue):
+    # Second stage: each describer keeps one request in flight with the AI model
+    while True:
+        item = image_queue.get()
+        if item is None:
+            result_queue.put(None)
+            return
+
+        filename, content_hash, image_bytes = item
+        try:
+            result_queue.put((filename, content_hash, get_valid_description(image_bytes), None))
+        except Exception as e:
+            print(f'Error describing {filename}:', e)
+            result_queue.put((filename, content_hash, '', None))
+
+
+def save_description(folder_path, filename, content_hash, description, journal):
+    # save the text in the same directory with the same file name except '.txt' extension
+    out_filename = os.path.splitext(filename)[0] + '.txt'
+    with open(os.path.join(folder_path, out_filename), 'w', encoding="utf8") as file:
+        file.write(description)
+    journal.record(os.path.join(folder_path, filename), 'described', description=description,
+                   content_hash=content_hash)
+
+
+def run_pipeline(folder_path, worker_count, walk_options=None):
+    image_queue = queue.Queue(maxsize=worker_count * 2)
+    result_queue = queue.Queue()
+
+    # Images described by an earlier run (even one that was interrupted) are skipped without asking the AI model
+    journal = ollama_image_journal.ImageJournal(folder_path, 'comfyui_training_images_describer')
+    duplicate_index = ollama_image_dedup.NearDuplicateIndex()
+    skipped_counts = Counter()
+
+    threading.Thread(target=read_images, args=(folder_path, walk_options or {}, image_queue, result_queue,
+                                               worker_count, journal, duplicate_index, skipped_counts),
+                     daemon=True).start()
+    for _ in range(worker_count):
+        threading.Thread(target=describe_images, args=(image_queue, result_queue), daemon=True).start()
+
+    # Final stage: save each description as soon as it arrives, in whatever order the describers finish
+    start_time = time.perf_counter()
+    described_counter = 0
+    reused_counter = 0
+    failed_counter = 0
+    finished_workers = 0
+    # Descriptions of the first image in each group of near-duplicates, and the near-duplicates waiting for them
+    group_descriptions = {}
+    waiting_duplicates = {}
+    while finished_workers < worker_count:
+        result = result_queue.get()
+        if result is None:
+            finished_workers += 1
+            continue
+
+        filename, content_hash, description, group_filename = result
+        if group_filename:
+            if group_filename in group_descriptions:
+                save_description(folder_path, filename, content_hash, group_descriptions[group_filename], journal)
+                duplicate_index.record_reuse()
+                reused_counter += 1
+                print(f'{filename}: near-duplicate of {group_filename} - reused its description')
+            else:
+                waiting_duplicates.setdefault(group_filename, []).append((filename, content_hash))
+            continue
+
+        if not description:
+            print(f'    No valid description for {filename} after {MAX_DESCRIBE_ATTEMPTS} attempts - skipping...')
+            failed_counter += 1
+            journal.record(os.path.join(folder_path, filename), 'failed', content_hash=content_hash)
+            continue
+
+        save_description(folder_path, filename, content_hash, description, journal)
+        described_counter += 1
+        images_per_second = described_counter / (time.perf_counter() - start_time)
+        print(f'{described_counter} described ({round(images_per_second, 2)} images per second) > {filename}: '
+              f'{description}')
+
+        group_descriptions[filename] = description
+        for duplicate_filename, duplicate_content_hash in waiting_duplicates.pop(filename, []):
+            save_description(folder_path, duplicate_filename, duplicate_content_hash, description, journal)
+            duplicate_index.record_reuse()
+            reused_counter += 1
+            print(f'{duplicate_filename}: near-duplicate of {filename} - reused its description')
+
+    # Near-duplicates of an image that could not be described (or read) are described on their own
+    for duplicate_filename, duplicate_content_hash in sum(waiting_duplicates.values(), []):
+        try:
+            description = get_valid_description(
+                ollama_image_preprocessor.get_image_bytes(os.path.join(folder_path, duplicate_filename)))
+        except Exception as e:
+            print(f'Error describing {duplicate_filename}:', e)
+            description = ''
+        if description:
+            save_description(folder_path, duplicate_filename, duplicate_content_hash, description, journal)
+            described_counter += 1
+            print(f'{described_counter} described > {duplicate_filename}: {description}')
+        else:
+            print(f'    No valid description for {duplicate_filename} - skipping...')
+            failed_counter += 1
+            journal.record(os.path.join(folder_path, duplicate_filename), 'failed', content_hash=duplicate_content_hash)
+
+    journal.close()
+    print(f'Described {described_counter} images, reused descriptions for {reused_counter} near-duplicates, '
+          f'{failed_counter} could not be described, {skipped_counts["already described"]} already described, '
+          f'{skipped_counts["unreadable"]} could not be read')
+    duplicate_index.print_summary(described_counter, ['comfyui_training_images_describer.describe_image'])
+
+
 if __name__ == '__main__':
     image_full_file_path = None
+    worker_count = 2
+    walk_options = {}
     if image_full_file_path is None:
         if len(sys.argv) > 1 and 'file_path=' in sys.argv[1]:
             parser = argparse.ArgumentParser()
             parser.add_argument('file_path', type=str, help='Path to the images to describe')
+            parser.add_argument('--workers', type=int, default=worker_count,
+                                help='Number of describe requests to keep in flight with the AI model')
+            parser.add_argument('--recursive', action='store_true', help='Describe images in subfolders too')
+            parser.add_argument('--include', nargs='+', metavar='PATTERN',
+                                help='Only describe images whose path in the folder matches one of these patterns, '
+                                     'such as "*.png" or "portraits/*"')
+            parser.add_argument('--exclude', nargs='+', metavar='PATTERN',
+                                help='Skip images and subfolders whose path in the folder matches one of these patterns')
             args = parser.parse_args()
+            worker_count = max(1, args.workers)
+            walk_options = {'recursive': args.recursive, 'include_patterns': args.include,
+                            'exclude_patterns': args.exclude}
             if not args.file_path:
                 image_full_file_path = input('Please provide a file path to the images you want to describe > ').strip()
             else:
@@ -54,34 +255,11 @@ if __name__ == '__main__':
             image_full_file_path = input('Please provide a file path to the images you want to describe > ')
 
     try:
-        # loop through every file in the directory
-        counter = 0
-        file_count = len(os.listdir(image_full_file_path))
-        for filename in os.listdir(image_full_file_path):
-            counter += 1
-            print(f'{counter} of {file_count} > Processing {filename}...')
-            # Check if the file is an image
-            if not filename.endswith('.png') and not filename.endswith('.jpg') and not filename.endswith('.jpeg'):
-                print('    Not an image file, skipping...')
-                continue
-
-            # continue if the file is already described
-            out_filename = os.path.splitext(filename)[0] + '.txt'
-            if os.path.exists(os.path.join(image_full_file_path, out_filename)):
-                print('    The image is already described - skipping...')
-                continue
-
-            description = ""
-            while len(description) == 0 or len(description) > 400 or len(description.split(' ')) > 50:
-                description = describe_image(os.path.join(image_full_file_path, filename)) + ', ' + OTHER_KEYWORDS if '<<' not in OTHER_KEYWORDS else ''
-            print('    Description:', description)
-
-            # save the text in the same directory with the same file name except '.txt' extension
-
-            with open(os.path.join(image_full_file_path, out_filename), 'w', encoding="utf8") as file:
-                file.write(description)
+        run_pipeline(image_full_file_path, worker_count, walk_options)
 
         print('Ollama Image Describer finished')
+        ollama_image_preprocessor.image_preprocessor.print_summary()
+        ollama_client.print_summary()
 
     except KeyboardInterrupt:
         print('Ollama Image Describer finished due to keyboard interrupt')
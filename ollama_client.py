@@ -0,0 +1,259 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+import httpx
+import ollama
+
+import ollama_metrics
+from ollama_text_chunker import estimate_tokens
+
+load_dotenv()
+
+# The Ollama server to use - the same variable the ollama command line tool reads
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+
+# A comma-separated list of Ollama servers to spread requests across, such as
+# 'http://gpu-box-1:11434,http://gpu-box-2:11434'. When it is not set, OLLAMA_HOST is used on its own.
+OLLAMA_HOSTS = [host.strip() for host in os.getenv("OLLAMA_HOSTS", "").split(',') if host.strip()] or [OLLAMA_HOST]
+
+# How long Ollama keeps a model loaded after its last request, such as '30m', '2h' or '-1' to keep it loaded
+# until the server stops. Ollama's own default is 5 minutes, which is shorter than the gap between many runs.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Seconds to wait for a response before giving up - long enough for a large model to load and answer
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "600"))
+
+# A host that fails is left out for this many seconds, doubling on each further failure up to the maximum
+HOST_EJECTION_SECONDS = 30
+MAX_HOST_EJECTION_SECONDS = 300
+
+# How often to ask each host which models it has loaded, and how long to wait for its answer. The question is asked
+# on the way to sending a request, so a host that has stopped answering must not hold the request up for long.
+LOADED_MODELS_REFRESH_SECONDS = 30
+LOADED_MODELS_TIMEOUT = 5
+
+
+class OllamaHost:
+    def __init__(self, url: str):
+        self.url = url
+        # Each host has one client for the whole process. It keeps its HTTP connections open between requests
+        # (and is safe to share between threads), so each call does not pay for a new connection to the server.
+        self.client = ollama.Client(host=url, timeout=OLLAMA_TIMEOUT)
+        self.status_client = ollama.Client(host=url, timeout=LOADED_MODELS_TIMEOUT)
+        self.outstanding_requests = 0
+        self.completed_requests = 0
+        self.failed_requests = 0
+        self.loaded_models = set()
+        self.missing_models = set()
+        self.loaded_models_refreshed_at = 0.0
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.last_used_at = 0.0
+
+
+class HostPool:
+    """Spreads requests across one or more Ollama servers.
+
+    Each request goes to the host with the fewest requests in progress, preferring a host that already has the
+    model loaded. A host that cannot be reached or returns a server error is left out for a while and then tried
+    again, and the request is retried on another host.
+    """
+
+    def __init__(self, urls: list):
+        self.hosts = [OllamaHost(url) for url in urls]
+        self.lock = threading.Lock()
+
+    def refresh_loaded_models(self, host: OllamaHost):
+        try:
+            running_models = host.status_client.ps()
+            host.loaded_models = {model['model'] for model in running_models.get('models') or []}
+        except (ConnectionError, httpx.TransportError, ollama.ResponseError):
+            self.mark_failed(host)
+
+    def choose_host(self, model: str, excluded_hosts: list) -> OllamaHost:
+        now = time.time()
+        candidates = [host for host in self.hosts if host not in excluded_hosts and model not in host.missing_models]
+        if not candidates:
+            return None
+
+        # Refresh what each host has loaded outside the lock, as it is a network request. Hosts that have been left
+        # out after failing are not asked - they are refreshed once they are back.
+        for host in candidates:
+            if len(self.hosts) > 1 and host.ejected_until <= now and \
+                    now - host.loaded_models_refreshed_at > LOADED_MODELS_REFRESH_SECONDS:
+                host.loaded_models_refreshed_at = now
+                self.refresh_loaded_models(host)
+
+        with self.lock:
+            healthy_hosts = [host for host in candidates if host.ejected_until <= now]
+            if not healthy_hosts:
+                # Every host has failed recently - try the one that is due to come back soonest
+                healthy_hosts = [min(candidates, key=lambda host: host.ejected_until)]
+
+            # A host without the model loaded counts as one extra request in progress, for the time it takes to load
+            host = min(healthy_hosts, key=lambda host: (
+                host.outstanding_requests + (0 if model in host.loaded_models else 1), host.last_used_at))
+            host.outstanding_requests += 1
+            host.last_used_at = now
+            return host
+
+    def mark_succeeded(self, host: OllamaHost, model: str):
+        with self.lock:
+            host.outstanding_requests -= 1
+            host.completed_requests += 1
+            host.consecutive_failures = 0
+            host.ejected_until = 0.0
+            host.loaded_models.add(model)
+
+    def mark_failed(self, host: OllamaHost, was_outstanding: bool = False):
+        with self.lock:
+            if was_outstanding:
+                host.outstanding_requests -= 1
+            host.failed_requests += 1
+            host.consecutive_failures += 1
+            ejection_seconds = min(MAX_HOST_EJECTION_SECONDS,
+                                   HOST_EJECTION_SECONDS * 2 ** (host.consecutive_failures - 1))
+            host.ejected_until = time.time() + ejection_seconds
+        if len(self.hosts) > 1:
+            print(f'Ollama server {host.url} failed - leaving it out for {ejection_seconds} seconds')
+
+    def release(self, host: OllamaHost):
+        # For a request that neither succeeded nor failed because of the host, such as a stream closed early
+        with self.lock:
+            host.outstanding_requests -= 1
+
+    def mark_model_missing(self, host: OllamaHost, model: str):
+        with self.lock:
+            host.outstanding_requests -= 1
+            host.missing_models.add(model)
+        if len(self.hosts) > 1:
+            print(f'Ollama server {host.url} does not have model {model} - sending its requests elsewhere')
+
+    def send_request(self, model: str, send):
+        # Calls send(client) on the best host, trying the other hosts in turn if it fails
+        tried_hosts = []
+        last_error = ConnectionError(f'No Ollama server is available for model {model}')
+        while True:
+            host = self.choose_host(model, tried_hosts)
+            if host is None:
+                raise last_error
+            tried_hosts.append(host)
+
+            try:
+                return host, send(host.client)
+            except (ConnectionError, httpx.TransportError) as e:
+                self.mark_failed(host, was_outstanding=True)
+                last_error = e
+            except ollama.ResponseError as e:
+                if e.status_code == 404:
+                    self.mark_model_missing(host, model)
+                elif e.status_code >= 500:
+                    self.mark_failed(host, was_outstanding=True)
+                else:
+                    self.release(host)
+                    raise
+                last_error = e
+            except BaseException:
+                # Any other error is not the host's fault, but the host must not go on counting the request
+                self.release(host)
+                raise
+
+    def print_summary(self):
+        if len(self.hosts) > 1:
+            for host in self.hosts:
+                print(f'{host.url}: {host.completed_requests} requests completed, {host.failed_requests} failed')
+
+
+host_pool = HostPool(OLLAMA_HOSTS)
+
+
+def chat(call_site: str, **kwargs):
+    """Sends a chat request to the least busy Ollama server, recording Ollama's timing fields against the call site.
+
+    Accepts the same arguments as ollama.chat. keep_alive defaults to OLLAMA_KEEP_ALIVE.
+    """
+    kwargs.setdefault('keep_alive', OLLAMA_KEEP_ALIVE)
+    model = kwargs.get('model')
+    prompt_tokens_sent = sum(estimate_tokens(message.get('content') or '') for message in kwargs.get('messages') or [])
+    start_time = time.perf_counter()
+
+    if kwargs.get('stream'):
+        # A stream only connects when its first chunk is read, so read it here, where a failed host can still be
+        # swapped for another one
+        def start_stream(host_client):
+            stream = host_client.chat(**kwargs)
+            return stream, next(stream)
+
+        host, (stream, first_chunk) = host_pool.send_request(model, start_stream)
+        return ollama_metrics.instrument_stream(call_site, model, finish_stream(host, model, stream, first_chunk),
+                                                start_time, prompt_tokens_sent)
+
+    host, response = host_pool.send_request(model, lambda host_client: host_client.chat(**kwargs))
+    host_pool.mark_succeeded(host, model)
+    ollama_metrics.record_call(call_site, model, response, time.perf_counter() - start_time,
+                               prompt_tokens_sent=prompt_tokens_sent)
+    return response
+
+
+def embed(call_site: str, **kwargs):
+    """Sends an embed request to the least busy Ollama server, recording Ollama's timing fields against the call site.
+
+    Accepts the same arguments as ollama.embed. keep_alive defaults to OLLAMA_KEEP_ALIVE.
+    """
+    kwargs.setdefault('keep_alive', OLLAMA_KEEP_ALIVE)
+    model = kwargs.get('model')
+    texts = kwargs.get('input') or []
+    prompt_tokens_sent = sum(estimate_tokens(text) for text in ([texts] if isinstance(texts, str) else texts))
+    start_time = time.perf_counter()
+
+    host, response = host_pool.send_request(model, lambda host_client: host_client.embed(**kwargs))
+    host_pool.mark_succeeded(host, model)
+    ollama_metrics.record_call(call_site, model, response, time.perf_counter() - start_time,
+                               prompt_tokens_sent=prompt_tokens_sent)
+    return response
+
+
+def finish_stream(host: OllamaHost, model: str, stream, first_chunk):
+    # The host counts the request as in progress until the stream has been read to the end, has failed or has been
+    # closed early (such as when a response is stopped for being too long)
+    outcome = 'closed'
+    try:
+        yield first_chunk
+        yield from stream
+        outcome = 'succeeded'
+    except (ConnectionError, httpx.TransportError):
+        outcome = 'failed'
+        raise
+    finally:
+        stream.close()
+        if outcome == 'succeeded':
+            host_pool.mark_succeeded(host, model)
+        elif outcome == 'failed':
+            host_pool.mark_failed(host, was_outstanding=True)
+        else:
+            host_pool.release(host)
+
+
+def warm_up(call_site: str, model: str) -> list:
+    # A generate request with an empty prompt only loads the model into memory - no tokens are generated.
+    # Every host loads the model, so requests can be spread across all of them straight away.
+    responses = []
+    for host in host_pool.hosts:
+        start_time = time.perf_counter()
+        try:
+            response = host.client.generate(model=model, prompt='', keep_alive=OLLAMA_KEEP_ALIVE)
+        except (ConnectionError, httpx.TransportError, ollama.ResponseError) as e:
+            print(f'Error loading model {model} on Ollama server {host.url}:', e)
+            host_pool.mark_failed(host)
+            continue
+
+        host.loaded_models.add(model)
+        ollama_metrics.record_call(call_site, model, response, time.perf_counter() - start_time)
+        responses.append((host.url, response))
+    return responses
+
+
+def print_summary():
+    host_pool.print_summary()
@@ -1,26 +1,59 @@
 from dotenv import load_dotenv
-import ollama
 import os
 
+import ollama_client
+import ollama_document_reader
+# The local converter is kept in its own module, without the AI model or the response cache, so the document reader
+# can use it without importing this script
+from ollama_html_parser import convert_html_to_plain_text
+from ollama_response_cache import ResponseCache
+
 load_dotenv()
 
 NUM_CTX = int(os.getenv("NUM_CTX", "8000"))
 summarising_ai_model = os.getenv("SUMMARISING_AI_MODEL", 'llama3.1:latest')
 
+# Set AI_HTML_FALLBACK=YES to ask the AI model to convert documents that the local converter cannot handle well
+AI_HTML_FALLBACK = os.getenv("AI_HTML_FALLBACK", "NO") == "YES"
+
+# Converted text shorter than this is treated as a failed conversion (the email summariser will not summarise
+# messages shorter than this either)
+MIN_READABLE_CHARS = 100
+
 ai_prompt_convert_html_to_plain_text = """
 You are an expert at converting HTML content to plain text. There is no need to retain any formatting or links,
 just return the plain text content. The user will provide you with an HTML message to convert.
 """
 
+# The same on-disk cache is used by the email summariser, so HTML already converted there is not converted again.
+# It is only opened when the AI model is first needed, so importing this module does not create the cache directory.
+response_cache = None
+
+
+def is_readable_conversion(plain_text: str) -> bool:
+    return len(plain_text) >= MIN_READABLE_CHARS
+
+
 def call_ai_model(model, prompt, user_content):
-    response = ollama.chat(
+    global response_cache
+    if response_cache is None:
+        response_cache = ResponseCache()
+
+    cached_response = response_cache.get(model, prompt, user_content)
+    if cached_response is not None:
+        return cached_response
+
+    response = ollama_client.chat(
+        'convert_html_to_plain_text.call_ai_model',
         model=model, options={"num_ctx": NUM_CTX},
         messages=[
             {'role': 'system', 'content': prompt},
             {'role': 'user', 'content': user_content},
         ])
+    response = response['message']['content'].strip()
 
-    return response['message']['content'].strip()
+    response_cache.put(model, prompt, user_content, response)
+    return response
 
 
 def ai_convert_html_to_plain_text(html_source: str) -> str:
@@ -29,13 +62,28 @@ def ai_convert_html_to_plain_text(html_source: str) -> str:
 
 
 if __name__ == "__main__":
-    print('Converting HTML to plain text using AI')
+    print('Converting HTML to plain text')
     html_file = input('Enter a filepath to an HTML document > ')
-    with open(html_file, 'r') as f:
-        html_lines = f.readlines()
-        html = ''
-        for line in html_lines:
-            html += line
-
-    plain_text = ai_convert_html_to_plain_text(html)
-    print(plain_text)
\ No newline at end of file
+
+    # The document is read a piece at a time from a memory map and converted as it is read, so even a very large
+    # export is never held in memory all at once. Files such as .eml and .txt are read with their own readers, and
+    # files with any other extension are read as HTML.
+    text_pieces = ollama_document_reader.read_document(html_file, default_extension='.html')
+
+    # Only the start of the text is held back, to check the conversion worked before printing it
+    first_pieces = []
+    for text_piece in text_pieces:
+        first_pieces.append(text_piece)
+        if is_readable_conversion(''.join(first_pieces)):
+            break
+    plain_text = ''.join(first_pieces)
+
+    if not is_readable_conversion(plain_text) and AI_HTML_FALLBACK:
+        print('The HTML could not be converted locally - converting using AI')
+        with open(html_file, 'r', encoding='utf8', errors='ignore') as f:
+            plain_text = ai_convert_html_to_plain_text(f.read())
+
+    print(plain_text, end='' if is_readable_conversion(plain_text) else '\n')
+    for text_piece in text_pieces:
+        print(text_piece, end='')
+    print()
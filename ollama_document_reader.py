@@ -0,0 +1,177 @@
+from email import policy
+from email.parser import BytesFeedParser
+import codecs
+import io
+import mmap
+import os
+
+import ollama_html_parser
+
+# Files are decoded this many bytes at a time, so only a small part of a large file is held as text at once
+READ_CHUNK_SIZE = 1048576
+
+# Text with no blank lines is still yielded once this many characters have built up, breaking at a line end or space
+MAX_PARAGRAPH_CHARS = 65536
+
+
+def iter_file_bytes(file_path: str):
+    # Yields the file's content in READ_CHUNK_SIZE pieces from a memory map, so the operating system pages the file
+    # in as it is read rather than Python reading it all into memory
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # An empty file cannot be memory mapped
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            if hasattr(mapped_file, 'madvise'):
+                # Tells the operating system the file is read from start to end, so it can read ahead and drop
+                # pages once they have been read
+                mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+            for offset in range(0, len(mapped_file), READ_CHUNK_SIZE):
+                yield mapped_file[offset:offset + READ_CHUNK_SIZE]
+
+
+def iter_decoded_text(file_path: str, encoding: str = None):
+    # Decodes the file a piece at a time. The incremental decoder carries a character (or a Windows line ending)
+    # split between two pieces over to the next one, and line endings become '\n'. Without an encoding, a UTF-16
+    # byte order mark is honoured and UTF-8 is assumed otherwise.
+    decoder = None
+    for file_bytes in iter_file_bytes(file_path):
+        if decoder is None:
+            if not encoding:
+                encoding = 'utf-16' if file_bytes[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE) else 'utf-8-sig'
+            decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(errors='replace'),
+                                                   translate=True)
+        text = decoder.decode(file_bytes)
+        if text:
+            yield text
+    if decoder is not None:
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+
+def read_text(file_path: str):
+    # Plain text and Markdown are passed on as they are - Markdown's headings and lists are readable to the AI model
+    return iter_decoded_text(file_path)
+
+
+def read_html(file_path: str):
+    # The HTML is fed to the converter a piece at a time, and the lines it has finished are passed on straight away
+    html_parser = ollama_html_parser.HTMLToTextParser()
+    for html_text in iter_decoded_text(file_path):
+        html_parser.feed(html_text)
+        text = html_parser.take_finished_text()
+        if text:
+            yield text + '\n'
+    html_parser.close()
+    text = html_parser.get_text()
+    if text:
+        yield text
+
+
+def read_email(file_path: str):
+    # The message's headers and its text body, or its HTML body converted to text if it has no text body.
+    # Attachments are left out. The email parser keeps the parsed message in memory, so a very large .eml file
+    # (one with large attachments) is held in memory while it is read.
+    email_parser = BytesFeedParser(policy=policy.default)
+    for file_bytes in iter_file_bytes(file_path):
+        email_parser.feed(file_bytes)
+    message = email_parser.close()
+
+    header_lines = [f'{header}: {message[header]}' for header in ('From', 'To', 'Date', 'Subject') if message[header]]
+    yield '\n'.join(header_lines) + '\n\n'
+
+    plain_text_parts = []
+    html_parts = []
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_disposition() == 'attachment':
+            continue
+        if part.get_content_type() == 'text/plain':
+            plain_text_parts.append(part)
+        elif part.get_content_type() == 'text/html':
+            html_parts.append(part)
+
+    for part in plain_text_parts or html_parts:
+        try:
+            content = part.get_content()
+        except (LookupError, ValueError):
+            content = (part.get_payload(decode=True) or b'').decode(errors='ignore')
+        if part.get_content_type() == 'text/html':
+            content = ollama_html_parser.convert_html_to_plain_text(content)
+        yield content + '\n'
+
+
+# The reader for each file extension. Each reader takes a file path and yields the document's text in pieces.
+READERS = {
+    '.txt': read_text,
+    '.md': read_text,
+    '.markdown': read_text,
+    '.html': read_html,
+    '.htm': read_html,
+    '.eml': read_email
+}
+
+
+def register_reader(extensions: list, reader):
+    # Adds a reader for more file types, or replaces the reader for a file type
+    for extension in extensions:
+        READERS[extension.lower()] = reader
+
+
+def is_supported(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in READERS
+
+
+def read_document(file_path: str, default_extension: str = None):
+    """Yields the text of a document in pieces, read lazily with the reader for its file extension.
+
+    Files with an extension that has no reader are read as if they had default_extension, or raise a ValueError if
+    there is no default.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    reader = READERS.get(extension) or READERS.get(default_extension or '')
+    if reader is None:
+        raise ValueError(f'There is no reader for {extension or "files without an extension"} files')
+    return reader(file_path)
+
+
+def split_long_paragraph(text: str) -> list:
+    # Breaks text longer than MAX_PARAGRAPH_CHARS at a line end, or a space if there is none, stepping through it
+    # rather than copying what is left after each break. The last piece may be shorter than the rest.
+    pieces = []
+    start_index = 0
+    while len(text) - start_index > MAX_PARAGRAPH_CHARS:
+        limit_index = start_index + MAX_PARAGRAPH_CHARS
+        break_index = text.rfind('\n', start_index, limit_index)
+        if break_index <= start_index:
+            break_index = text.rfind(' ', start_index, limit_index)
+        if break_index <= start_index:
+            break_index = limit_index
+        pieces.append(text[start_index:break_index])
+        start_index = break_index
+    pieces.append(text[start_index:])
+    return pieces
+
+
+def read_document_paragraphs(file_path: str, default_extension: str = None):
+    # Yields the document's paragraphs (text separated by blank lines) one at a time, joining up paragraphs that
+    # were split between the reader's pieces. No paragraph is longer than MAX_PARAGRAPH_CHARS.
+    pending_text = ''
+    for text in read_document(file_path, default_extension):
+        pending_text += text
+        paragraphs = pending_text.split('\n\n')
+        pending_text = paragraphs.pop()
+        for paragraph in paragraphs:
+            for piece in split_long_paragraph(paragraph):
+                if piece.strip():
+                    yield piece.strip()
+
+        # Text with no blank line yet is broken up too, keeping only the last piece to join up with what follows
+        *pieces, pending_text = split_long_paragraph(pending_text)
+        for piece in pieces:
+            if piece.strip():
+                yield piece.strip()
+
+    for piece in split_long_paragraph(pending_text):
+        if piece.strip():
+            yield piece.strip()
@@ -1,38 +1,212 @@
-import ollama
+import ollama_client
 import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
 from docx import Document
+from docx.table import Table
+import ollama_document_reader
+from ollama_text_chunker import CHARS_PER_TOKEN, estimate_tokens, pack_sections_into_chunks
+
+ai_model_content_prompt = "Please summarize the document the user provides, using no more than the number of words " \
+                          "given at the end of their message."
+
+ai_model_part_prompt = "The user provides one part of a longer document. Please summarize it, keeping its section " \
+                       "headings and the facts, figures and conclusions that a summary of the whole document would " \
+                       "need, using no more than the number of words given at the end of their message."
+
+NOTHING_RETURNED_MESSAGE = 'Nothing was returned from the AI model. Please try again.'
+
+SUMMARISING_AI_MODEL = 'command-r:35b'
+
+# The model's context window in tokens. Documents too long to fit are summarised in parts, and then the summaries
+# of the parts are summarised.
+NUM_CTX = int(os.getenv("NUM_CTX", "8000"))
+
+# The summary of each part is at least this many words, so that each part keeps its key points
+MIN_PART_SUMMARY_WORDS = 150
+
+# Summaries of parts that are still too long to fit are summarised again, but no more than this many times
+MAX_REDUCE_LEVELS = 5
+
+# In batch mode, the output folder keeps a record of the document and settings behind each summary, so documents
+# that have not changed are not summarised again, and a summary of each run with the time taken for each document
+BATCH_RECORD_FILE_NAME = '.document_summaries.json'
+RUN_SUMMARY_FILE_NAME = 'run_summary.json'
+
+# Limits the requests in flight with the AI model, across every document being summarised at once
+ai_request_semaphore = threading.BoundedSemaphore(2)
+
+
+def print_line(text):
+    # print() writes the text and its newline separately, so lines printed while several documents are summarised
+    # at once could run together - the whole line is written in one go instead
+    print(text + '\n', end='', flush=True)
+
+
+def get_heading_level(paragraph):
+    style_name = paragraph.style.name if paragraph.style is not None else ''
+    if style_name == 'Title':
+        return 1
+    if style_name.startswith('Heading ') and style_name[8:].isdigit():
+        return int(style_name[8:])
+    return 0
+
+
+def iter_document_text(document):
+    # Yields (heading_level, text) for each page header, paragraph and table row in the order they appear in the
+    # document, with a heading level of 0 for anything that is not a heading
+    header_texts = set()
+    for section in document.sections:
+        if section.header.is_linked_to_previous:
+            continue
+        for paragraph in section.header.paragraphs:
+            text = paragraph.text.strip()
+            if text and text not in header_texts:
+                header_texts.add(text)
+                yield 0, text
+
+    for block in document.iter_inner_content():
+        if isinstance(block, Table):
+            for row in block.rows:
+                # A merged cell is returned once for each column it spans, so repeated cells are left out
+                cells = []
+                for cell in row.cells:
+                    text = ' '.join(cell.text.split())
+                    if text and (not cells or cells[-1] != text):
+                        cells.append(text)
+                if cells:
+                    yield 0, ' | '.join(cells)
+        else:
+            text = block.text.strip()
+            if text:
+                yield get_heading_level(block), text
+
+
+def read_document_sections(document_file_path):
+    # Returns the document's text split into sections, each starting with its heading (marked with '#' as in
+    # Markdown, so the AI model can see the document's structure)
+    sections = []
+    section_lines = []
+    with open(document_file_path, 'rb') as file:
+        document = Document(file)
+        for heading_level, text in iter_document_text(document):
+            if heading_level:
+                if section_lines:
+                    sections.append('\n'.join(section_lines))
+                section_lines = ['#' * heading_level + ' ' + text]
+            else:
+                section_lines.append(text)
+    if section_lines:
+        sections.append('\n'.join(section_lines))
+    return sections
 
 
 # this function reads a Microsoft Word document and returns the content
 # as a plain text string. It uses the python-docx library to read the document
 def read_word_document(document_file_path):
-    text = ''
-    with open(document_file_path, 'rb') as file:
-        document = Document(file)
-        for paragraph in document.paragraphs:
-            text += paragraph.text + '\n'
-    return text
-
-
-def summarise_text(text, word_count):
-    print('Sending text to the AI model for summarisation...')
-    ai_model_content_prompt = "Please summarize this document using no more than {} words. Here is the document:".format(
-        word_count)
-    response = ollama.chat(
-        model='command-r:35b',
-        messages=[
-            {
-                'role': 'user',
-                'content': ai_model_content_prompt + text
-            },
-        ],
-    )
+    return '\n\n'.join(read_document_sections(document_file_path))
+
+
+def get_max_text_tokens(word_count):
+    # The space left in the context window once the system prompt and a summary of word_count words are allowed for
+    prompt_tokens = max(estimate_tokens(ai_model_content_prompt), estimate_tokens(ai_model_part_prompt))
+    return max(500, NUM_CTX - prompt_tokens - word_count * 4 // 3 - 50)
+
+
+def summarise_text(text, word_count, system_prompt=ai_model_content_prompt):
+    # The word count goes after the document so that the start of the prompt is the same for every request
+    with ai_request_semaphore:
+        response = ollama_client.chat(
+            'document_summariser.summarise_text' if system_prompt == ai_model_content_prompt
+            else 'document_summariser.summarise_part',
+            model=SUMMARISING_AI_MODEL,
+            options={'num_ctx': NUM_CTX},
+            messages=[
+                {
+                    'role': 'system',
+                    'content': system_prompt
+                },
+                {
+                    'role': 'user',
+                    'content': text + '\n\nUse no more than {} words.'.format(word_count)
+                },
+            ],
+        )
 
     if response['message']['content']:
-        return response['message']['content'], int(response['total_duration'] / 1000000000), int(
-            response['eval_duration'] / 1000000000)
+        return response['message']['content'], round(response['total_duration'] / 1000000000, 1), round(
+            response['eval_duration'] / 1000000000, 1)
+
+    return NOTHING_RETURNED_MESSAGE, 0, 0
+
+
+def map_in_order(function, items, worker_count):
+    # Like ThreadPoolExecutor.map, but only takes the next item once a worker is close to free, so parts that are
+    # produced as a large file is read are never read far ahead of the AI model
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, worker_count)) as executor:
+        pending_futures = deque()
+        for item in items:
+            pending_futures.append(executor.submit(function, item))
+            if len(pending_futures) >= max(1, worker_count) * 2:
+                results.append(pending_futures.popleft().result())
+        results.extend(future.result() for future in pending_futures)
+    return results
+
+
+def summarise_document(sections, word_count, worker_count, estimated_tokens):
+    # Summarises a document of any length. A document too long to fit in the context window is split into parts
+    # at section boundaries, the parts are summarised in parallel, and the summaries of the parts are then treated
+    # as the sections of a shorter document - repeating until it fits. The sections can be produced lazily as the
+    # document is read, so estimated_tokens (the document's approximate size) is used to share out the word count.
+    # Returns the summary, the AI model's total and evaluation seconds across all requests and the request count.
+    max_tokens = get_max_text_tokens(word_count)
+    total_duration = 0
+    eval_duration = 0
+    request_count = 0
+
+    for _ in range(MAX_REDUCE_LEVELS):
+        parts = pack_sections_into_chunks(sections, max_tokens)
+        first_parts = list(islice(parts, 2))
+        if len(first_parts) < 2:
+            sections = first_parts
+            break
+
+        estimated_part_count = max(2, -(-estimated_tokens // max_tokens))
+        part_word_count = min(word_count, max(MIN_PART_SUMMARY_WORDS, 2 * word_count // estimated_part_count))
+        print_line(f'Sending the document to the AI model in about {estimated_part_count} parts, '
+                   f'{worker_count} at a time...')
+        part_results = map_in_order(lambda part: summarise_text(part, part_word_count, ai_model_part_prompt),
+                                    chain(first_parts, parts), worker_count)
+
+        sections = [summary for summary, _, _ in part_results if summary != NOTHING_RETURNED_MESSAGE]
+        total_duration += sum(part_total_duration for _, part_total_duration, _ in part_results)
+        eval_duration += sum(part_eval_duration for _, _, part_eval_duration in part_results)
+        request_count += len(part_results)
+        estimated_tokens = sum(estimate_tokens(section) for section in sections)
+        if not sections:
+            return NOTHING_RETURNED_MESSAGE, total_duration, eval_duration, request_count
 
-    return 'Nothing was returned from the AI model. Please try again.', 0, 0
+    # Nothing is sent to the AI model for an empty document, or for summaries that would still be cut short by the
+    # context window - the model would write a summary of nothing, or of only the start of the text
+    if not sections:
+        raise ValueError('The document has no text to summarise')
+    final_tokens = estimate_tokens('\n\n'.join(sections))
+    if final_tokens > max_tokens:
+        raise ValueError(f'The summaries of the document\'s parts are still about {final_tokens} tokens after '
+                         f'{MAX_REDUCE_LEVELS} rounds of summarising, more than the {max_tokens} that fit - '
+                         f'raise NUM_CTX or lower the word count')
+
+    print_line('Sending text to the AI model for summarisation...')
+    summary, final_total_duration, final_eval_duration = summarise_text('\n\n'.join(sections), word_count)
+    return summary, round(total_duration + final_total_duration, 1), round(eval_duration + final_eval_duration, 1), \
+        request_count + 1
 
 
 def word_wrap_text(text, max_length):
@@ -52,33 +226,197 @@ def word_wrap_text(text, max_length):
     return '\n'.join(lines)
 
 
+def is_summarisable(document_file_name):
+    return document_file_name.lower().endswith('.docx') or ollama_document_reader.is_supported(document_file_name)
+
+
+def summarise_document_file(document_file_path, output_file_path, word_count, word_wrap, worker_count):
+    # Summarises one document into output_file_path, returning the figures for the run summary
+    start_time = time.perf_counter()
+    if document_file_path.lower().endswith('.docx'):
+        document_sections = read_document_sections(document_file_path)
+        estimated_tokens = sum(estimate_tokens(section) for section in document_sections)
+    else:
+        # Other documents are read lazily, a paragraph at a time, so a very large export is never held in memory
+        document_sections = ollama_document_reader.read_document_paragraphs(document_file_path)
+        estimated_tokens = os.path.getsize(document_file_path) // CHARS_PER_TOKEN
+
+    word_counts = Counter()
+
+    def count_words(sections):
+        for section in sections:
+            word_counts['input'] += len(section.split())
+            yield section
+
+    output, total_duration, eval_duration, request_count = summarise_document(count_words(document_sections),
+                                                                              word_count, worker_count,
+                                                                              estimated_tokens)
+    input_word_count = word_counts['input']
+    print_line(f'The number of words sent to the LLM model from {os.path.basename(document_file_path)}: '
+               f'{input_word_count}')
+    succeeded = output != NOTHING_RETURNED_MESSAGE
+
+    if word_wrap:
+        output = word_wrap_text(output, word_wrap)
+
+    with open(output_file_path, 'w') as file:
+        file.write(output)
+
+    return {'succeeded': succeeded, 'input_words': input_word_count, 'output_words': len(output.split(' ')),
+            'requests': request_count, 'model_seconds': total_duration, 'eval_seconds': eval_duration,
+            'seconds': round(time.perf_counter() - start_time, 1)}
+
+
+def get_file_hash(file_path):
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1048576), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_summary_settings(word_count, word_wrap):
+    # Everything that affects a summary - if any of it changes, every document is summarised again
+    prompts_hash = hashlib.sha256((ai_model_content_prompt + ai_model_part_prompt).encode()).hexdigest()
+    return {'model': SUMMARISING_AI_MODEL, 'wordcount': word_count, 'wordwrap': word_wrap, 'num_ctx': NUM_CTX,
+            'prompts': prompts_hash}
+
+
+def read_batch_records(batch_record_file_path):
+    try:
+        with open(batch_record_file_path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f'Error reading {batch_record_file_path} - summarising every document: {e}')
+        return {}
+
+
+def write_json_file(file_path, data):
+    # Write to a temporary file first so an interrupted run never leaves a half-written file
+    temp_file_path = file_path + '.tmp'
+    with open(temp_file_path, 'w') as file:
+        json.dump(data, file, indent=2)
+    os.replace(temp_file_path, file_path)
+
+
+def get_summary_file_name(document_file_name):
+    # Every document keeps its extension in the summary's name (report.docx.txt, notes.md.txt), so report.docx and
+    # report.txt are not both summarised to report.txt, and a .txt document is never overwritten by another
+    # document's summary when the output folder is the input folder
+    return document_file_name + '.txt'
+
+
+def summarise_folder(input_dir, output_dir, word_count, word_wrap, worker_count):
+    # Summarises every document in input_dir (Word documents, and the text, Markdown, HTML and email files the
+    # document reader supports) into a .txt file in output_dir, worker_count documents at a time. Documents whose
+    # content and summary settings are the same as when their summary was written are skipped.
+    start_time = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    batch_record_file_path = os.path.join(output_dir, BATCH_RECORD_FILE_NAME)
+    batch_records = read_batch_records(batch_record_file_path)
+    batch_records_lock = threading.Lock()
+    settings = get_summary_settings(word_count, word_wrap)
+
+    # Word leaves '~$' lock files next to documents that are open. Summaries written by an earlier run are not
+    # summarised themselves, in case the output folder is the input folder.
+    summary_file_paths = {os.path.abspath(record['output_file']) for record in batch_records.values()}
+    document_file_names = sorted(file_name for file_name in os.listdir(input_dir)
+                                 if is_summarisable(file_name) and not file_name.startswith('~$') and
+                                 os.path.abspath(os.path.join(input_dir, file_name)) not in summary_file_paths)
+    print(f'Ollama Document Summariser found {len(document_file_names)} documents in {input_dir}')
+    document_file_paths = {os.path.abspath(os.path.join(input_dir, file_name)) for file_name in document_file_names}
+
+    def summarise_if_changed(document_file_name):
+        document_file_path = os.path.join(input_dir, document_file_name)
+        output_file_path = os.path.join(output_dir, get_summary_file_name(document_file_name))
+        document_start_time = time.perf_counter()
+        if os.path.abspath(output_file_path) in document_file_paths:
+            # Such as report.docx.txt next to report.docx - the summary would replace a document being summarised
+            print_line(f'Error summarising {document_file_name}: its summary would overwrite the document '
+                       f'{get_summary_file_name(document_file_name)}')
+            return {'document': document_file_name, 'status': 'failed',
+                    'error': 'the summary would overwrite another document', 'seconds': 0}
+        try:
+            content_hash = get_file_hash(document_file_path)
+            previous_record = batch_records.get(document_file_name)
+            if previous_record and previous_record['content_hash'] == content_hash and \
+                    previous_record['settings'] == settings and os.path.exists(output_file_path):
+                return {'document': document_file_name, 'status': 'unchanged', 'seconds': 0}
+
+            print_line(f'Ollama Document Summariser reading document: {document_file_path}')
+            result = summarise_document_file(document_file_path, output_file_path, word_count, word_wrap,
+                                             worker_count)
+        except Exception as e:
+            print_line(f'Error summarising {document_file_name}: {e}')
+            return {'document': document_file_name, 'status': 'failed', 'error': str(e),
+                    'seconds': round(time.perf_counter() - document_start_time, 1)}
+
+        if not result.pop('succeeded'):
+            print_line(f'Error summarising {document_file_name}: nothing was returned from the AI model')
+            return dict(result, document=document_file_name, status='failed')
+
+        # Recorded as each document finishes, so an interrupted run does not lose the documents already summarised
+        with batch_records_lock:
+            batch_records[document_file_name] = {'content_hash': content_hash, 'settings': settings,
+                                                 'output_file': output_file_path}
+            write_json_file(batch_record_file_path, batch_records)
+        print_line(f'Summarised {document_file_name} in {result["seconds"]} seconds with {result["requests"]} requests')
+        return dict(result, document=document_file_name, status='summarised')
+
+    with ThreadPoolExecutor(max_workers=max(1, worker_count)) as executor:
+        results = list(executor.map(summarise_if_changed, document_file_names))
+
+    status_counts = {status: sum(result['status'] == status for result in results)
+                     for status in ('summarised', 'unchanged', 'failed')}
+    run_summary = dict(status_counts, input_dir=input_dir, settings=settings,
+                       seconds=round(time.perf_counter() - start_time, 1), documents=results)
+    write_json_file(os.path.join(output_dir, RUN_SUMMARY_FILE_NAME), run_summary)
+
+    for result in results:
+        if result['status'] != 'unchanged':
+            print(f'    {result["document"]}: {result["status"]} in {result["seconds"]} seconds')
+    print(f'Summarised {status_counts["summarised"]} documents, skipped {status_counts["unchanged"]} unchanged, '
+          f'{status_counts["failed"]} failed, in {run_summary["seconds"]} seconds. '
+          f'Run summary saved to "{os.path.join(output_dir, RUN_SUMMARY_FILE_NAME)}"')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--file', type=str, help='Path to the document to read and summarise')
+    parser.add_argument('--file', type=str,
+                        help='Path to the document to read and summarise (.docx, .txt, .md, .html or .eml)')
     parser.add_argument('--wordcount', type=str, help='Count of words to be used in the summary', default=1000)
     parser.add_argument('--wordwrap', type=str, help='Optional word-wrap after n characters', default=None)
     parser.add_argument('--output', type=str, help='Path to save the summarised text to')
+    parser.add_argument('--input-dir', type=str,
+                        help='Summarise every document in this folder instead of a single --file')
+    parser.add_argument('--output-dir', type=str, help='With --input-dir, the folder to save the summaries to')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Number of requests to send to the AI model at once, and with --input-dir the number '
+                             'of documents to summarise at once')
     args = parser.parse_args()
+    ai_request_semaphore = threading.BoundedSemaphore(max(1, args.workers))
 
     try:
-        print('Ollama Document Summariser reading document:', args.file)
         output_word_count = int(args.wordcount)
-        word_text = read_word_document(args.file)
-        print('The number of words to send to the LLM model:', len(word_text.split(' ')))
-        output, total_duration, eval_duration = summarise_text(word_text, output_word_count)
+        word_wrap = int(args.wordwrap) if args.wordwrap else None
 
-        if args.wordwrap:
-            output = word_wrap_text(output, int(args.wordwrap))
-
-        with open(args.output, 'w') as file:
-            file.write(output)
+        if args.input_dir and not args.output_dir:
+            print('Please provide --output-dir to save the summaries to')
+        elif args.input_dir:
+            summarise_folder(args.input_dir, args.output_dir, output_word_count, word_wrap, args.workers)
+        else:
+            print('Ollama Document Summariser reading document:', args.file)
+            result = summarise_document_file(args.file, args.output, output_word_count, word_wrap, args.workers)
 
-        print('Completed - results saved to "{}" using {} words.'.format(args.output, len(output.split(' '))))
+            print('Completed - results saved to "{}" using {} words.'.format(args.output, result['output_words']))
 
-        if args.wordwrap:
-            print('The output has been word-wrapped after every {} characters.'.format(args.wordwrap))
-        print('Total processing time was {} seconds of which evaluation took {} seconds.'.format(total_duration,
-                                                                                                 eval_duration))
+            if args.wordwrap:
+                print('The output has been word-wrapped after every {} characters.'.format(args.wordwrap))
+            print('Completed in {} seconds. The AI model spent {} seconds on {} requests, of which evaluation took {} '
+                  'seconds.'.format(result['seconds'], result['model_seconds'], result['requests'],
+                                    result['eval_seconds']))
 
     except Exception as e:
         print('Error:', e)
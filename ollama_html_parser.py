@@ -0,0 +1,99 @@
+from html.parser import HTMLParser
+import re
+
+# The content of these elements is never readable text. <head> is not one of them because its end tag may be left
+# out - the elements inside it that hold text (<title>, <style> and <script>) are skipped instead.
+SKIPPED_TAGS = {'script', 'style', 'title', 'noscript', 'template', 'svg', 'object', 'iframe'}
+
+# These elements start a new line of text
+BLOCK_TAGS = {'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption', 'figure',
+              'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol', 'p',
+              'pre', 'section', 'table', 'td', 'th', 'tr', 'ul'}
+
+# These elements have no end tag, so they must never be pushed onto the skipped elements stack
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+HIDDEN_STYLE_REGEX = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden|max-height\s*:\s*0|font-size\s*:\s*0')
+
+
+# A streaming HTML to plain text converter - HTML can be fed to it in as many pieces as needed
+class HTMLToTextParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.current_line = []
+        self.skipped_tags_stack = []
+
+    @staticmethod
+    def is_hidden(attrs: dict) -> bool:
+        return 'hidden' in attrs or bool(HIDDEN_STYLE_REGEX.search(attrs.get('style') or ''))
+
+    @staticmethod
+    def is_tracking_pixel(attrs: dict) -> bool:
+        tiny_image = attrs.get('width') in ('0', '1') or attrs.get('height') in ('0', '1')
+        return tiny_image or HTMLToTextParser.is_hidden(attrs)
+
+    def end_line(self):
+        line = ' '.join(''.join(self.current_line).split())
+        if line:
+            self.lines.append(line)
+        self.current_line = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.skipped_tags_stack:
+            if tag not in VOID_TAGS:
+                self.skipped_tags_stack.append(tag)
+            return
+
+        attrs = dict(attrs)
+        if tag in SKIPPED_TAGS or (tag not in VOID_TAGS and self.is_hidden(attrs)):
+            self.skipped_tags_stack.append(tag)
+        elif tag in BLOCK_TAGS:
+            self.end_line()
+        elif tag == 'img' and attrs.get('alt') and not self.is_tracking_pixel(attrs):
+            self.current_line.append(f" {attrs['alt']} ")
+
+    def handle_startendtag(self, tag, attrs):
+        # Self-closing tags such as <br/> or <div/> have no content, so they are never added to the skipped tags stack
+        if self.skipped_tags_stack:
+            return
+
+        if tag in VOID_TAGS:
+            self.handle_starttag(tag, attrs)
+        else:
+            self.end_line()
+
+    def handle_endtag(self, tag):
+        if self.skipped_tags_stack:
+            # Pop back to the matching start tag so badly nested HTML does not hide the rest of the document
+            if tag in self.skipped_tags_stack:
+                while self.skipped_tags_stack.pop() != tag:
+                    pass
+                if not self.skipped_tags_stack and (tag in BLOCK_TAGS or tag in SKIPPED_TAGS):
+                    # The text either side of a skipped block is not joined into one line
+                    self.end_line()
+            return
+
+        if tag in BLOCK_TAGS:
+            self.end_line()
+
+    def handle_data(self, data):
+        if not self.skipped_tags_stack:
+            self.current_line.append(data)
+
+    def take_finished_text(self) -> str:
+        # Returns the lines finished so far and forgets them, so a large document can be passed on a piece at a time
+        text = '\n'.join(self.lines)
+        self.lines = []
+        return text
+
+    def get_text(self) -> str:
+        self.end_line()
+        return '\n'.join(self.lines)
+
+
+def convert_html_to_plain_text(html_source: str) -> str:
+    parser = HTMLToTextParser()
+    parser.feed(html_source)
+    parser.close()
+    return parser.get_text()
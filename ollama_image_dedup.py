@@ -0,0 +1,120 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+import ollama_metrics
+
+# NumPy and Pillow are optional - without them every image is described on its own
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+load_dotenv()
+
+# Images are shrunk to this many pixels square before hashing, and the hash is taken from the lowest
+# HASH_SIZE x HASH_SIZE frequencies of their discrete cosine transform, giving a 64 bit hash
+HASH_IMAGE_SIZE = 32
+HASH_SIZE = 8
+
+
+def get_dct_matrix(size: int):
+    # The orthonormal DCT-II matrix, so the 2D transform of an image is matrix @ image @ matrix.T
+    rows = np.arange(size).reshape(-1, 1)
+    columns = np.arange(size).reshape(1, -1)
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * columns + 1) * rows / (2 * size))
+    matrix[0, :] = np.sqrt(1 / size)
+    return matrix
+
+
+class NearDuplicateIndex:
+    """Groups near-identical images, such as seed variations and upscales of the same ComfyUI prompt.
+
+    Each image gets a 64 bit perceptual hash that changes little when the image is resized, re-encoded or slightly
+    altered. An image whose hash is within max_distance bits of the first image of an existing group joins that
+    group, so only the first image in each group needs describing by the AI model.
+    """
+
+    def __init__(self, max_distance: int = None):
+        self.max_distance = max_distance if max_distance is not None else \
+            int(os.getenv('IMAGE_DUPLICATE_MAX_DISTANCE', '4'))
+        self.enabled = os.getenv('IMAGE_DUPLICATE_DETECTION', 'YES') == 'YES' and np is not None and Image is not None
+
+        self.lock = threading.Lock()
+        self.group_image_paths = []
+        self.group_sizes = []
+        self.reused_descriptions = 0
+        if self.enabled:
+            self.dct_matrix = get_dct_matrix(HASH_IMAGE_SIZE)
+            # The hash of each group's first image, in an array that doubles in size as it fills up
+            self.group_hashes = np.zeros(64, dtype=np.uint64)
+
+        if os.getenv('IMAGE_DUPLICATE_DETECTION', 'YES') == 'YES' and not self.enabled:
+            print('NumPy and Pillow are needed to spot near-duplicate images, so every image will be described '
+                  '(install them with: pip install numpy pillow)')
+
+    def get_perceptual_hash(self, image_file_path: str) -> int:
+        with Image.open(image_file_path) as image:
+            # Lets Pillow decode a JPEG at a fraction of its size, which is much quicker for large photos
+            image.draft('L', (HASH_IMAGE_SIZE * 4, HASH_IMAGE_SIZE * 4))
+            pixels = np.asarray(image.convert('L').resize((HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), Image.LANCZOS),
+                                dtype=np.float64)
+
+        frequencies = (self.dct_matrix @ pixels @ self.dct_matrix.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+        # The first frequency is the image's average brightness, which would skew the median
+        bits = frequencies > np.median(frequencies[1:])
+        return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+    def find_group(self, image_file_path: str) -> str:
+        """Returns the path of the first image in the group of near-duplicates this image belongs to.
+
+        Returns None if the image starts a new group (or cannot be hashed), in which case it should be described.
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            image_hash = np.uint64(self.get_perceptual_hash(image_file_path))
+        except Exception as e:
+            print(f'Error hashing {image_file_path} - describing it on its own:', e)
+            return None
+
+        with self.lock:
+            group_count = len(self.group_image_paths)
+            if group_count:
+                # Hamming distance to every group at once: XOR the hashes, then count the bits that differ
+                differing_bits = np.bitwise_xor(self.group_hashes[:group_count], image_hash)
+                distances = np.unpackbits(differing_bits.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+                closest_group = int(np.argmin(distances))
+                if distances[closest_group] <= self.max_distance:
+                    self.group_sizes[closest_group] += 1
+                    return self.group_image_paths[closest_group]
+
+            if group_count == len(self.group_hashes):
+                self.group_hashes = np.concatenate([self.group_hashes, np.zeros_like(self.group_hashes)])
+            self.group_hashes[group_count] = image_hash
+            self.group_image_paths.append(image_file_path)
+            self.group_sizes.append(1)
+            return None
+
+    def record_reuse(self):
+        with self.lock:
+            self.reused_descriptions += 1
+
+    def print_summary(self, described_count: int, description_call_sites: list):
+        # The requests saved are estimated from the average number of description requests (retries included) made
+        # for each image described. Other requests, such as scoring a file name, are not counted.
+        if not self.reused_descriptions:
+            return
+        with ollama_metrics.metrics_lock:
+            call_count = sum(totals['calls'] for (call_site, _), totals in ollama_metrics.call_site_totals.items()
+                             if call_site in description_call_sites)
+        requests_per_image = max(1.0, call_count / described_count) if described_count else 1
+        duplicate_groups = sum(group_size > 1 for group_size in self.group_sizes)
+        print(f'Near-duplicate images: {self.reused_descriptions} images in {duplicate_groups} groups reused a '
+              f'description, saving about {round(self.reused_descriptions * requests_per_image)} AI model requests')
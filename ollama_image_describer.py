@@ -1,4 +1,5 @@
-import ollama
+import ollama_client
+import ollama_image_preprocessor
 import os
 import shutil
 import argparse
@@ -15,21 +16,21 @@ to focus on those keywords more.
 
 
 def describe_image(image_file_path):
-    with open(image_file_path, 'rb') as file:
-        response = ollama.chat(
-            model='llava:34b',
-            messages=[
-                {
-                    'role': 'system',
-                    'content': ai_model_content_prompt
-                },
-                {
-                    'role': 'user',
-                    'content': 'Please describe this image in a manner suitable for use as a stable diffusion prompt',
-                    'images': [file.read()],
-                },
-            ],
-        )
+    response = ollama_client.chat(
+        'ollama_image_describer.describe_image',
+        model='llava:34b',
+        messages=[
+            {
+                'role': 'system',
+                'content': ai_model_content_prompt
+            },
+            {
+                'role': 'user',
+                'content': 'Please describe this image in a manner suitable for use as a stable diffusion prompt',
+                'images': [ollama_image_preprocessor.get_image_bytes(image_file_path)],
+            },
+        ],
+    )
 
     return response['message']['content']
 
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Images whose journal entry has one of these statuses are finished, and are skipped when a script is run again
+FINISHED_STATUSES = {'well_described', 'renamed', 'described'}
+
+JOURNAL_FILE_NAME = '.ollama_image_journal.sqlite3'
+
+
+class ImageJournal:
+    """A SQLite record of the work done on each image, so an interrupted run can carry on where it left off.
+
+    Entries are keyed by the script and a hash of the image's content, so a renamed image is still recognised and
+    a changed image is treated as new work. The file's size and modification time are stored alongside the hash,
+    so unchanged files do not have to be read and hashed again on every run.
+    """
+
+    def __init__(self, folder_path: str, script_name: str):
+        self.script_name = script_name
+        self.enabled = os.getenv('IMAGE_JOURNAL', 'YES') == 'YES'
+        self.journal_file_path = os.getenv('IMAGE_JOURNAL_FILE') or os.path.join(folder_path, JOURNAL_FILE_NAME)
+        self.lock = threading.Lock()
+        self.connection = None
+
+        if self.enabled:
+            # Shared by the threads of the ComfyUI describer - the lock ensures only one uses it at a time
+            self.connection = sqlite3.connect(self.journal_file_path, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS images (
+                    script TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    file_size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    score INTEGER,
+                    description TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (script, content_hash)
+                )''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS images_by_path ON images (script, file_path)')
+            self.connection.commit()
+
+    def get_content_hash(self, image_file_path: str) -> str:
+        file_stat = os.stat(image_file_path)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT content_hash FROM images WHERE script = ? AND file_path = ? AND file_size = ? AND mtime_ns = ?',
+                (self.script_name, os.path.abspath(image_file_path), file_stat.st_size, file_stat.st_mtime_ns)
+            ).fetchone()
+        if row:
+            return row[0]
+
+        content_hash = hashlib.sha256()
+        with open(image_file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1048576), b''):
+                content_hash.update(block)
+        return content_hash.hexdigest()
+
+    def get_entry(self, image_file_path: str) -> dict:
+        # Returns the journal entry for the image's current content, with a status of None if the content has not
+        # been seen before, or None if the journal is turned off
+        if not self.enabled:
+            return None
+
+        content_hash = self.get_content_hash(image_file_path)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT status, score, description FROM images WHERE script = ? AND content_hash = ?',
+                (self.script_name, content_hash)
+            ).fetchone()
+        status, score, description = row or (None, None, None)
+        return {'content_hash': content_hash, 'status': status, 'score': score, 'description': description}
+
+    def has_entry_for_path(self, image_file_path: str) -> bool:
+        # True if this file has been recorded before, whatever its content was at the time
+        if not self.enabled:
+            return False
+
+        with self.lock:
+            row = self.connection.execute('SELECT 1 FROM images WHERE script = ? AND file_path = ?',
+                                          (self.script_name, os.path.abspath(image_file_path))).fetchone()
+        return row is not None
+
+    def record(self, image_file_path: str, status: str, score: int = None, description: str = None,
+               content_hash: str = None):
+        # Each entry is committed straight away, so nothing is lost if the run is interrupted
+        if not self.enabled:
+            return
+
+        content_hash = content_hash or self.get_content_hash(image_file_path)
+        file_stat = os.stat(image_file_path)
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.script_name, content_hash, os.path.abspath(image_file_path), file_stat.st_size,
+                 file_stat.st_mtime_ns, status, score, description, time.time()))
+            self.connection.commit()
+
+    def close(self):
+        if self.connection:
+            with self.lock:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+import hashlib
+import io
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from ollama_response_cache import EVICTION_CHECK_INTERVAL, evict_cache_dir, touch_entry
+
+# Pillow is optional - without it images are sent to the model exactly as they are on disk
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+load_dotenv()
+
+# How many preprocessed images to keep in memory, so retries for the same image do not read the file again
+MEMORY_CACHE_SIZE = 32
+
+
+class ImagePreprocessor:
+    """Shrinks images to the vision model's input resolution and re-encodes them as JPEG before they are sent.
+
+    llava works on images of at most 672 pixels square, so a multi-megabyte photo is mostly thrown away by the
+    model after being base64-encoded and sent over HTTP. Preprocessed images are kept in memory (keyed by file path,
+    size and modification time) and on disk (keyed by a hash of the file's content and the preprocessing settings).
+    """
+
+    def __init__(self, cache_dir: str = None, max_pixels: int = None, jpeg_quality: int = None):
+        self.cache_dir = cache_dir or os.getenv('IMAGE_CACHE_DIR', '.ollama_image_cache')
+        self.max_pixels = max_pixels or int(os.getenv('IMAGE_MAX_PIXELS', '672'))
+        self.jpeg_quality = jpeg_quality or int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+        self.max_size_bytes = int(os.getenv('IMAGE_CACHE_MAX_SIZE_MB', '512')) * 1024 * 1024
+        self.max_age_seconds = int(os.getenv('IMAGE_CACHE_MAX_AGE_DAYS', '30')) * 24 * 60 * 60
+        self.enabled = os.getenv('IMAGE_PREPROCESSING', 'YES') == 'YES' and Image is not None
+        self.disk_cache_enabled = self.enabled and os.getenv('IMAGE_CACHE', 'YES') == 'YES'
+
+        self.memory_cache = OrderedDict()
+        self.bytes_read = 0
+        self.bytes_sent = 0
+        self.writes_since_eviction = 0
+        self.lock = threading.Lock()
+
+        if os.getenv('IMAGE_PREPROCESSING', 'YES') == 'YES' and Image is None:
+            print('Pillow is not installed, so images will be sent to the AI model at full size '
+                  '(install it with: pip install pillow)')
+
+        if self.disk_cache_enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            evict_cache_dir(self.cache_dir, self.max_size_bytes, self.max_age_seconds)
+
+    def get_image_bytes(self, image_file_path: str) -> bytes:
+        file_stat = os.stat(image_file_path)
+        memory_key = (os.path.abspath(image_file_path), file_stat.st_size, file_stat.st_mtime_ns)
+        with self.lock:
+            if memory_key in self.memory_cache:
+                self.memory_cache.move_to_end(memory_key)
+                return self.memory_cache[memory_key]
+
+        with open(image_file_path, 'rb') as file:
+            original_bytes = file.read()
+
+        image_bytes = self.preprocess(original_bytes) if self.enabled else original_bytes
+
+        with self.lock:
+            self.bytes_read += len(original_bytes)
+            self.bytes_sent += len(image_bytes)
+            self.memory_cache[memory_key] = image_bytes
+            while len(self.memory_cache) > MEMORY_CACHE_SIZE:
+                self.memory_cache.popitem(last=False)
+        return image_bytes
+
+    def get_entry_path(self, original_bytes: bytes) -> str:
+        key_hash = hashlib.sha256(original_bytes)
+        key_hash.update(f'\0{self.max_pixels}\0{self.jpeg_quality}'.encode())
+        key = key_hash.hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + '.image')
+
+    def preprocess(self, original_bytes: bytes) -> bytes:
+        entry_path = self.get_entry_path(original_bytes) if self.disk_cache_enabled else None
+        if entry_path:
+            try:
+                with open(entry_path, 'rb') as file:
+                    image_bytes = file.read()
+                touch_entry(entry_path, os.path.getmtime(entry_path))
+                return image_bytes
+            except OSError:
+                pass
+
+        try:
+            image_bytes = self.resize_and_encode(original_bytes)
+        except Exception as e:
+            print('Error preprocessing image - sending it unchanged:', e)
+            return original_bytes
+
+        if entry_path:
+            self.write_cache_entry(entry_path, image_bytes)
+        return image_bytes
+
+    def resize_and_encode(self, original_bytes: bytes) -> bytes:
+        with Image.open(io.BytesIO(original_bytes)) as image:
+            original_size = image.size
+            # Apply any EXIF rotation, since the rotation tag is lost when the image is re-encoded
+            image = ImageOps.exif_transpose(image)
+
+            if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+                # JPEG has no transparency, so transparent areas are shown on white as an image viewer would
+                rgba_image = image.convert('RGBA')
+                image = Image.new('RGB', rgba_image.size, (255, 255, 255))
+                image.paste(rgba_image, mask=rgba_image.getchannel('A'))
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            image.thumbnail((self.max_pixels, self.max_pixels), Image.LANCZOS)
+
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=self.jpeg_quality, optimize=True)
+
+        # A small image may already be smaller than its JPEG version
+        if max(original_size) <= self.max_pixels and len(original_bytes) <= output.tell():
+            return original_bytes
+        return output.getvalue()
+
+    def write_cache_entry(self, entry_path: str, image_bytes: bytes):
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            # write to a temporary file first so a reader never sees a half-written entry
+            temp_path = f'{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'wb') as file:
+                file.write(image_bytes)
+            os.replace(temp_path, entry_path)
+        except OSError as e:
+            print('Error writing to image cache:', e)
+            return
+
+        with self.lock:
+            self.writes_since_eviction += 1
+            check_eviction = self.writes_since_eviction >= EVICTION_CHECK_INTERVAL
+            if check_eviction:
+                self.writes_since_eviction = 0
+
+        if check_eviction:
+            evict_cache_dir(self.cache_dir, self.max_size_bytes, self.max_age_seconds)
+
+    def print_summary(self):
+        if self.bytes_read:
+            print(f'Image preprocessing: read {round(self.bytes_read / 1048576, 1)} MB of images, '
+                  f'sent {round(self.bytes_sent / 1048576, 1)} MB to the AI model')
+
+
+# One preprocessor shared by everything in the process, so its memory cache is shared too
+image_preprocessor = ImagePreprocessor()
+
+
+def get_image_bytes(image_file_path: str) -> bytes:
+    return image_preprocessor.get_image_bytes(image_file_path)
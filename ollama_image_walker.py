@@ -0,0 +1,58 @@
+from fnmatch import fnmatch
+import os
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def is_matching(relative_path: str, include_patterns: list, exclude_patterns: list) -> bool:
+    # Patterns are matched against the path relative to the folder being walked, with '/' between folders,
+    # so '*.png' matches PNG images in every subfolder and 'rejects/*' matches everything in the rejects folder
+    if exclude_patterns and any(fnmatch(relative_path, pattern) for pattern in exclude_patterns):
+        return False
+    return not include_patterns or any(fnmatch(relative_path, pattern) for pattern in include_patterns)
+
+
+def walk_images(folder_path: str, recursive: bool = False, include_patterns: list = None,
+                exclude_patterns: list = None, sidecar_extension: str = None):
+    """Yields (image_path, sidecar_path) for each image in the folder, as the folder is read.
+
+    Images are recognised by their extension, whatever its case. With recursive=True, subfolders are walked as well
+    (subfolders matching an exclude pattern are not entered). If sidecar_extension is given, such as '.txt',
+    sidecar_path is the path of the file next to the image with the same name and that extension, or None if there
+    is none.
+
+    The folder is read once with os.scandir, which gets each entry's type along with its name, and each image is
+    yielded as soon as it is read, so only the current folder's sidecar paths are held in memory. An image whose
+    sidecar was listed before it needs no further check. For any other image, one os.path.exists call looks for a
+    sidecar listed later in the folder, with the extension in the case given.
+    """
+    folders_to_walk = [(folder_path, '')]
+    while folders_to_walk:
+        current_folder_path, relative_folder_path = folders_to_walk.pop()
+        sidecar_paths = {}
+
+        with os.scandir(current_folder_path) as entries:
+            for entry in entries:
+                relative_path = relative_folder_path + entry.name
+                # Symbolic links to folders are not followed, so a link back up the tree cannot cause a loop
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and is_matching(relative_path, None, exclude_patterns):
+                        folders_to_walk.append((entry.path, relative_path + '/'))
+                    continue
+
+                stem, extension = os.path.splitext(entry.name)
+                extension = extension.lower()
+                if sidecar_extension and extension == sidecar_extension:
+                    sidecar_paths[stem] = entry.path
+                    continue
+
+                if extension not in IMAGE_EXTENSIONS or not entry.is_file() or \
+                        not is_matching(relative_path, include_patterns, exclude_patterns):
+                    continue
+
+                if not sidecar_extension:
+                    yield entry.path, None
+                    continue
+
+                sidecar_path = sidecar_paths.get(stem) or os.path.join(current_folder_path, stem + sidecar_extension)
+                yield entry.path, sidecar_path if stem in sidecar_paths or os.path.exists(sidecar_path) else None
@@ -0,0 +1,131 @@
+from datetime import datetime, timezone
+import json
+import os
+import threading
+import time
+
+# Set OLLAMA_METRICS_JSONL to a file path to log every call as a line of JSON, and OLLAMA_METRICS_PROM to a file path
+# to keep Prometheus text-format totals (for example for node_exporter's textfile collector). Set
+# OLLAMA_METRICS_PRINT_CALLS=YES to print the prompt tokens evaluated by every call as it completes.
+OLLAMA_METRICS_PRINT_CALLS = os.getenv("OLLAMA_METRICS_PRINT_CALLS", "NO") == "YES"
+
+# Ollama reports its durations in nanoseconds
+NANOSECONDS_PER_SECOND = 1000000000
+
+# The Ollama response fields recorded for every call, and whether each one is a duration
+OLLAMA_METRIC_FIELDS = {
+    'load_duration': True,
+    'prompt_eval_count': False,
+    'prompt_eval_duration': True,
+    'eval_count': False,
+    'eval_duration': True,
+    'total_duration': True
+}
+
+metrics_lock = threading.Lock()
+
+# Running totals per (call site, model), used for the Prometheus file and the end of run summary
+call_site_totals = {}
+
+
+def instrument_stream(call_site: str, model: str, stream, start_time: float, prompt_tokens_sent: int = 0):
+    # Ollama only sends its timing fields in the final chunk of a stream, so a stream that is closed early
+    # is recorded with the fields it has (none) and marked as aborted
+    final_chunk = {}
+    try:
+        for chunk in stream:
+            if chunk.get('done'):
+                final_chunk = chunk
+            yield chunk
+    finally:
+        # Closing Ollama's stream drops the connection, which stops the generation if it has not finished
+        if hasattr(stream, 'close'):
+            stream.close()
+        record_call(call_site, model, final_chunk, time.perf_counter() - start_time, aborted=not final_chunk,
+                    prompt_tokens_sent=prompt_tokens_sent)
+
+
+def record_call(call_site: str, model: str, response, wall_seconds: float, aborted: bool = False,
+                prompt_tokens_sent: int = 0):
+    # prompt_tokens_sent is an estimate of the prompt's size. Ollama's prompt_eval_count only counts the tokens it
+    # had to evaluate, so when it is well below the estimate the rest came from Ollama's cache of the previous prompt.
+    record = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'call_site': call_site,
+        'model': model,
+        'wall_seconds': round(wall_seconds, 4),
+        'aborted': aborted,
+        'prompt_tokens_sent': prompt_tokens_sent
+    }
+    for field, is_duration in OLLAMA_METRIC_FIELDS.items():
+        value = response.get(field) or 0
+        record[field] = round(value / NANOSECONDS_PER_SECOND, 4) if is_duration else value
+
+    with metrics_lock:
+        totals = call_site_totals.setdefault((call_site, model), {'calls': 0, 'aborted_calls': 0, 'wall_seconds': 0,
+                                                                  'prompt_tokens_sent': 0})
+        totals['calls'] += 1
+        totals['aborted_calls'] += int(aborted)
+        totals['wall_seconds'] += wall_seconds
+        totals['prompt_tokens_sent'] += prompt_tokens_sent
+        for field in OLLAMA_METRIC_FIELDS:
+            totals[field] = totals.get(field, 0) + record[field]
+
+        if OLLAMA_METRICS_PRINT_CALLS:
+            print(f'{call_site} ({model}): prompt eval {record["prompt_eval_count"]} of about {prompt_tokens_sent} '
+                  f'tokens in {record["prompt_eval_duration"]}s')
+
+        try:
+            write_jsonl_record(record)
+            write_prometheus_file()
+        except OSError as e:
+            print('Error writing Ollama metrics:', e)
+
+
+def write_jsonl_record(record: dict):
+    jsonl_file_path = os.getenv('OLLAMA_METRICS_JSONL')
+    if jsonl_file_path:
+        with open(jsonl_file_path, 'a', encoding='utf8') as file:
+            file.write(json.dumps(record) + '\n')
+
+
+def write_prometheus_file():
+    prometheus_file_path = os.getenv('OLLAMA_METRICS_PROM')
+    if not prometheus_file_path:
+        return
+
+    metric_definitions = [
+        ('ollama_calls_total', 'calls', 'Number of Ollama chat calls'),
+        ('ollama_aborted_calls_total', 'aborted_calls', 'Number of streamed Ollama chat calls stopped early'),
+        ('ollama_wall_seconds_total', 'wall_seconds', 'Wall clock time spent waiting for Ollama'),
+        ('ollama_load_duration_seconds_total', 'load_duration', 'Time Ollama spent loading models'),
+        ('ollama_prompt_tokens_sent_total', 'prompt_tokens_sent', 'Estimated prompt tokens sent to Ollama'),
+        ('ollama_prompt_eval_tokens_total', 'prompt_eval_count', 'Prompt tokens evaluated by Ollama'),
+        ('ollama_prompt_eval_duration_seconds_total', 'prompt_eval_duration', 'Time Ollama spent evaluating prompts'),
+        ('ollama_eval_tokens_total', 'eval_count', 'Tokens generated by Ollama'),
+        ('ollama_eval_duration_seconds_total', 'eval_duration', 'Time Ollama spent generating tokens'),
+        ('ollama_total_duration_seconds_total', 'total_duration', 'Total time reported by Ollama')
+    ]
+
+    lines = []
+    for metric_name, field, help_text in metric_definitions:
+        lines.append(f'# HELP {metric_name} {help_text}')
+        lines.append(f'# TYPE {metric_name} counter')
+        for (call_site, model), totals in sorted(call_site_totals.items(), key=lambda item: str(item[0])):
+            lines.append(f'{metric_name}{{call_site="{call_site}",model="{model}"}} {round(totals[field], 4)}')
+
+    # Write to a temporary file first so a scraper never reads a half-written file
+    temp_file_path = prometheus_file_path + '.tmp'
+    with open(temp_file_path, 'w', encoding='utf8') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.replace(temp_file_path, prometheus_file_path)
+
+
+def print_summary():
+    with metrics_lock:
+        for (call_site, model), totals in sorted(call_site_totals.items(), key=lambda item: str(item[0])):
+            print(f'{call_site} ({model}): {totals["calls"]} calls, '
+                  f'load {round(totals["load_duration"], 1)}s, '
+                  f'prompt eval {totals["prompt_eval_count"]} of about {totals["prompt_tokens_sent"]} tokens sent '
+                  f'in {round(totals["prompt_eval_duration"], 1)}s, '
+                  f'eval {totals["eval_count"]} tokens in {round(totals["eval_duration"], 1)}s')
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# How often (in cache writes) to check the cache directory against its size and age limits
+EVICTION_CHECK_INTERVAL = 100
+
+
+def touch_entry(entry_path: str, modified_time: float):
+    # Marks an entry as just used by setting its access time, so size-based eviction removes the least recently used
+    # entries first. Its modification time stays as the time it was written, which age-based eviction goes by.
+    os.utime(entry_path, (time.time(), modified_time))
+
+
+class ResponseCache:
+    """An on-disk cache of AI model responses, keyed by a hash of the model, prompt and user content.
+
+    Each response is stored in its own small JSON file so the cache can be shared safely between scripts and threads.
+    Entries written more than max_age_days ago are removed however often they are used, and when the cache grows
+    beyond max_size_mb the least recently used entries are removed first.
+    """
+
+    def __init__(self, cache_dir: str = None, max_size_mb: int = None, max_age_days: int = None):
+        self.cache_dir = cache_dir or os.getenv('RESPONSE_CACHE_DIR', '.ollama_response_cache')
+        self.max_size_bytes = (max_size_mb or int(os.getenv('RESPONSE_CACHE_MAX_SIZE_MB', '256'))) * 1024 * 1024
+        self.max_age_seconds = (max_age_days or int(os.getenv('RESPONSE_CACHE_MAX_AGE_DAYS', '30'))) * 24 * 60 * 60
+        self.enabled = os.getenv('RESPONSE_CACHE', 'YES') == 'YES'
+
+        self.hits = 0
+        self.misses = 0
+        self.writes_since_eviction = 0
+        self.lock = threading.Lock()
+
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.evict()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, user_content: str) -> str:
+        key_hash = hashlib.sha256()
+        for part in (model, prompt, user_content):
+            key_hash.update(part.encode('utf-8', errors='ignore'))
+            # separate the parts so that ('ab', 'c') and ('a', 'bc') do not share a key
+            key_hash.update(b'\0')
+        return key_hash.hexdigest()
+
+    def get_entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, model: str, prompt: str, user_content: str):
+        if not self.enabled:
+            return None
+
+        entry_path = self.get_entry_path(self.make_key(model, prompt, user_content))
+        try:
+            modified_time = os.path.getmtime(entry_path)
+            with open(entry_path, 'r', encoding='utf8') as file:
+                entry = json.load(file)
+            if time.time() - entry.get('created', modified_time) > self.max_age_seconds:
+                os.remove(entry_path)
+                raise FileNotFoundError(entry_path)
+            response = entry['response']
+
+            touch_entry(entry_path, modified_time)
+            with self.lock:
+                self.hits += 1
+            return response
+        except (FileNotFoundError, ValueError, KeyError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+    def put(self, model: str, prompt: str, user_content: str, response: str):
+        if not self.enabled or not response:
+            return
+
+        entry_path = self.get_entry_path(self.make_key(model, prompt, user_content))
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+            # write to a temporary file first so a reader never sees a half-written entry
+            temp_path = f'{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'w', encoding='utf8') as file:
+                json.dump({'model': model, 'created': time.time(), 'response': response}, file)
+            os.replace(temp_path, entry_path)
+        except OSError as e:
+            print('Error writing to response cache:', e)
+            return
+
+        with self.lock:
+            self.writes_since_eviction += 1
+            check_eviction = self.writes_since_eviction >= EVICTION_CHECK_INTERVAL
+            if check_eviction:
+                self.writes_since_eviction = 0
+
+        if check_eviction:
+            self.evict()
+
+    def evict(self):
+        evict_cache_dir(self.cache_dir, self.max_size_bytes, self.max_age_seconds)
+
+
+def evict_cache_dir(cache_dir: str, max_size_bytes: int, max_age_seconds: int):
+    # Removes entries written more than max_age_seconds ago (their modification time), then the least recently used
+    # entries (their access time) until the directory is no larger than max_size_bytes
+    now = time.time()
+    entries = []
+    total_size = 0
+
+    for dir_path, _, file_names in os.walk(cache_dir):
+        for file_name in file_names:
+            entry_path = os.path.join(dir_path, file_name)
+            try:
+                entry_stat = os.stat(entry_path)
+                if now - entry_stat.st_mtime > max_age_seconds:
+                    os.remove(entry_path)
+                    continue
+            except OSError:
+                continue
+
+            entries.append((entry_stat.st_atime, entry_stat.st_size, entry_path))
+            total_size += entry_stat.st_size
+
+    if total_size <= max_size_bytes:
+        return
+
+    # remove the least recently used entries until the cache is back within its size limit
+    for _, entry_size, entry_path in sorted(entries):
+        try:
+            os.remove(entry_path)
+            total_size -= entry_size
+        except OSError:
+            continue
+
+        if total_size <= max_size_bytes:
+            break
@@ -0,0 +1,82 @@
+import os
+
+from dotenv import load_dotenv
+
+import ollama_client
+
+# NumPy is optional - without it every summary is kept on its own
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+load_dotenv()
+
+
+class SemanticClusterer:
+    """Groups texts that say much the same thing, such as copies of a newsletter or a run of similar notifications.
+
+    Each text is embedded by an Ollama embedding model, and texts whose embeddings have a cosine similarity of at
+    least the threshold with the first text of a cluster join that cluster.
+    """
+
+    def __init__(self, threshold: float = None):
+        self.threshold = threshold if threshold is not None else \
+            float(os.getenv('SEMANTIC_CLUSTERING_THRESHOLD', '0.9'))
+        self.embedding_ai_model = os.getenv('EMBEDDING_AI_MODEL', 'nomic-embed-text:latest')
+        self.batch_size = max(1, int(os.getenv('EMBEDDING_BATCH_SIZE', '100')))
+        self.enabled = os.getenv('SEMANTIC_CLUSTERING', 'NO') == 'YES' and np is not None
+
+        self.clustered_texts = 0
+        self.cluster_count = 0
+
+        if os.getenv('SEMANTIC_CLUSTERING', 'NO') == 'YES' and not self.enabled:
+            print('NumPy is needed to group similar messages, so every message will be kept on its own '
+                  '(install it with: pip install numpy)')
+
+    def embed_texts(self, texts: list, call_site: str):
+        # Returns one unit-length row for each text, asking for up to batch_size embeddings in each request
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        embeddings = []
+        for i in range(0, len(texts), self.batch_size):
+            response = ollama_client.embed(call_site, model=self.embedding_ai_model,
+                                           input=texts[i:i + self.batch_size])
+            embeddings.extend(response['embeddings'])
+
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        # An empty embedding stays as zeros, so it is not similar to anything
+        return embeddings / np.where(norms > 0, norms, 1)
+
+    def cluster_embeddings(self, embeddings) -> list:
+        """Returns the clusters as lists of row numbers, in order of each cluster's first row.
+
+        The row closest to the middle of each cluster comes first, to stand for the rest of the cluster.
+        """
+        unclustered = np.ones(len(embeddings), dtype=bool)
+        clusters = []
+        for i in range(len(embeddings)):
+            if not unclustered[i]:
+                continue
+            # Cosine similarity to every row at once - the rows are unit length, so it is their dot product
+            members_mask = unclustered & (embeddings @ embeddings[i] >= self.threshold)
+            members_mask[i] = True
+            unclustered &= ~members_mask
+            members = np.flatnonzero(members_mask)
+
+            if len(members) > 1:
+                centroid = embeddings[members].mean(axis=0)
+                representative = members[int(np.argmax(embeddings[members] @ centroid))]
+                members = [representative] + [member for member in members if member != representative]
+            clusters.append([int(member) for member in members])
+
+        self.clustered_texts += len(embeddings)
+        self.cluster_count += len(clusters)
+        return clusters
+
+    def print_summary(self):
+        if self.clustered_texts:
+            print(f'Semantic clustering: {self.clustered_texts} messages grouped into {self.cluster_count} '
+                  f'entries (similarity threshold {self.threshold})')
@@ -1,14 +1,26 @@
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta, timezone
 from email.header import decode_header
 import email
 import email.message
 import imaplib
+import json
 import os
 import re
 import smtplib
+import threading
+import time
 
 from dotenv import load_dotenv
-import ollama
+
+import ollama_client
+import ollama_metrics
+from ollama_convert_html_to_plain_text import (ai_prompt_convert_html_to_plain_text, convert_html_to_plain_text,
+                                                is_readable_conversion)
+from ollama_response_cache import ResponseCache
+from ollama_semantic_clusterer import SemanticClusterer
+from ollama_text_chunker import estimate_tokens, split_text_into_chunks
 
 load_dotenv()
 
@@ -19,10 +31,108 @@ allowed_categories_list = [
 ]
 
 
-def fetch_email_by_id(mail, email_id):
-    status, msg_data = mail.fetch(email_id, "(RFC822)")
-    raw_email = msg_data[0][1]
-    return email.message_from_bytes(raw_email)
+# Only these headers are needed to filter and deduplicate messages, so they are fetched before any message bodies.
+# BODY.PEEK does not set the \Seen flag on the message.
+IMAP_HEADER_FIELDS = '(BODY.PEEK[HEADER.FIELDS (DATE FROM SUBJECT MESSAGE-ID)])'
+
+# Content too long for the context window is answered in chunks and the answers combined, up to this many times over
+MAX_REDUCE_LEVELS = 3
+
+
+def compress_message_id_set(email_ids: list) -> str:
+    # Turns IDs such as [1, 2, 3, 5, 7, 8] into the IMAP message set '1:3,5,7:8'
+    ranges = []
+    for email_id in sorted(int(email_id) for email_id in email_ids):
+        if ranges and email_id == ranges[-1][1] + 1:
+            ranges[-1][1] = email_id
+        else:
+            ranges.append([email_id, email_id])
+
+    return ','.join(str(start) if start == end else f'{start}:{end}' for start, end in ranges)
+
+
+def fetch_emails_by_ids(mail, email_ids: list, message_parts: str, batch_size: int):
+    # Fetch the messages by UID in batches using one FETCH command per batch rather than one per message.
+    # Messages are yielded as (uid, message) one batch at a time so only one batch is held in memory at once.
+    for i in range(0, len(email_ids), batch_size):
+        status, msg_data = mail.uid('FETCH', compress_message_id_set(email_ids[i:i + batch_size]), message_parts)
+        if status != 'OK':
+            print('Error fetching messages:', status)
+            continue
+
+        for response_part in msg_data:
+            # Each message arrives as a tuple of (b'<seq> (UID <uid> <message parts> {<size>}', <raw bytes>)
+            if isinstance(response_part, tuple):
+                uid_match = re.search(rb'UID (\d+)', response_part[0])
+                if uid_match:
+                    yield int(uid_match.group(1)), email.message_from_bytes(response_part[1])
+
+        print('.', end='', flush=True)
+
+
+def run_task_graph(tasks: dict, max_workers: int) -> dict:
+    # tasks maps each task name to (function, args, names of the tasks it depends on). A task is started as soon as
+    # all of its dependencies have finished, and is called with its args followed by the results of its
+    # dependencies. Returns a dict of task name to result.
+    results = {}
+    pending_tasks = dict(tasks)
+    running_tasks = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while pending_tasks or running_tasks:
+            for task_name, (function, args, dependencies) in list(pending_tasks.items()):
+                if all(dependency in results for dependency in dependencies):
+                    dependency_results = [results[dependency] for dependency in dependencies]
+                    running_tasks[executor.submit(function, *args, *dependency_results)] = task_name
+                    del pending_tasks[task_name]
+
+            if not running_tasks:
+                raise ValueError(f'Tasks with missing or circular dependencies: {", ".join(pending_tasks)}')
+
+            finished_tasks, _ = wait(running_tasks, return_when=FIRST_COMPLETED)
+            for future in finished_tasks:
+                results[running_tasks.pop(future)] = future.result()
+
+    return results
+
+
+class MessageRecord:
+    # __slots__ keeps each record small, as a run can hold thousands of messages
+    __slots__ = ('imap_id', 'message_id', 'date_sent', 'date_sent_datetime', 'sender', 'subject', 'plain_text', 'html',
+                 'summary', 'category')
+
+    def __init__(self, message_id, date_sent, sender, subject, imap_id=None):
+        self.imap_id = imap_id
+        self.message_id = message_id
+        self.date_sent = date_sent
+        self.date_sent_datetime = parse_email_date(date_sent)
+        self.sender = sender
+        self.subject = subject
+        self.plain_text = ''
+        self.html = ''
+        self.summary = ''
+        self.category = 'UNPROCESSED'
+
+
+def parse_email_date(date_sent):
+    try:
+        return datetime.strptime(date_sent, '%a, %d %b %Y %H:%M:%S %z')
+    except (TypeError, ValueError):
+        return None
+
+
+def merge_message_cluster(messages: list) -> MessageRecord:
+    # One entry standing for a cluster of similar messages, with the first message's summary and a count of the rest
+    if len(messages) == 1:
+        return messages[0]
+    representative = messages[0]
+    senders = list(dict.fromkeys(message.sender for message in messages))
+    sender_text = ', '.join(senders[:3]) + (f' and {len(senders) - 3} others' if len(senders) > 3 else '')
+    merged_message = MessageRecord(representative.message_id, representative.date_sent, sender_text,
+                                   representative.subject)
+    merged_message.category = representative.category
+    merged_message.summary = f'{representative.summary} ({len(messages)} similar messages)'
+    return merged_message
 
 
 def format_concluding_paragraph(paragraph: str) -> str:
@@ -44,11 +154,32 @@ class EmailSummariser:
         self.ai_model_top_headlines_prompt = ""
         self.ai_model_combined_prompt = ""
         self.ai_model_convert_html_to_plain_text_prompt = ""
+        self.ai_model_combine_parts_note = ""
         self.gmail_account_username = os.getenv("GMAIL_USERNAME")
         self.gmail_account_password = os.getenv("GMAIL_PASSWORD")
         self.INDIVIDUAL_EMAIL_SUMMARIES = os.getenv("INDIVIDUAL_EMAIL_SUMMARIES", "NO") == "YES"
         self.NEWSREADER_SCRIPT = os.getenv("NEWSREADER_SCRIPT", "NO") == "YES"
         self.NUM_CTX = int(os.getenv("NUM_CTX", "8000"))
+        self.MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "1"))
+        # Room left in the context window for the model's response when sizing the text sent to it
+        self.RESPONSE_TOKEN_RESERVE = int(os.getenv("RESPONSE_TOKEN_RESERVE", "1000"))
+        # Streaming lets the script measure time-to-first-token and stop generations that are going wrong
+        self.STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "NO") == "YES"
+        self.MAX_RESPONSE_CHARS = int(os.getenv("MAX_RESPONSE_CHARS", "4000"))
+        self.stream_metrics_list = []
+        self.IMAP_FETCH_BATCH_SIZE = int(os.getenv("IMAP_FETCH_BATCH_SIZE", "250"))
+        self.INCREMENTAL_SYNC = os.getenv("INCREMENTAL_SYNC", "NO") == "YES"
+        self.AI_HTML_FALLBACK = os.getenv("AI_HTML_FALLBACK", "NO") == "YES"
+        self.IMAP_STATE_FILE = os.getenv("IMAP_STATE_FILE", "imap_sync_state.json")
+        # Gmail by default - point these at another provider, or at the stand-in servers in benchmarks/
+        self.IMAP_SERVER = os.getenv("IMAP_SERVER", "imap.gmail.com")
+        self.IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+        self.SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+        self.SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+        self.MAIL_USE_SSL = os.getenv("MAIL_USE_SSL", "YES") == "YES"
+
+        # The UIDVALIDITY and highest UID seen by this run, saved once the summary email has been sent
+        self.pending_sync_state = {}
 
         self.HOURS_TO_FETCH = os.getenv("HOURS_TO_FETCH", "24")
         self.HOURS_TO_FETCH = int(self.HOURS_TO_FETCH) if self.HOURS_TO_FETCH.isdigit() else 24
@@ -57,13 +188,27 @@ class EmailSummariser:
 
         self.messages_data = {
             'messages_list': [],
+            'messages_index': {},
             'category_summary_dict': {}
         }
 
         self.categorising_ai_model = os.getenv("CATEGORISING_AI_MODEL", 'llama3.1:latest')
         self.summarising_ai_model = os.getenv("SUMMARISING_AI_MODEL", 'llama3.1:latest')
 
+        # Limits the number of AI requests in flight, including requests for the chunks of long messages
+        self.ai_request_semaphore = threading.BoundedSemaphore(max(1, self.MAX_CONCURRENT_REQUESTS))
+
+        # Summaries and conversions already produced by a previous run are reused from this cache
+        self.response_cache = ResponseCache()
+
+        # Messages saying much the same thing can be merged into one entry before the category headlines are written
+        self.semantic_clusterer = SemanticClusterer()
+
+        # The system prompts never change during a run, so Ollama can reuse its cached evaluation of them from one
+        # request to the next. Anything that varies, such as the time the bulletin is read out, goes at the end
+        # of the user's message instead.
         self.init_ai_prompts()
+        self.read_out_time_note = f'\n\nThis script will be read out at {datetime.now().strftime("%Y-%m-%d %H:%M")}.'
 
     def init_ai_prompts(self):
         self.ai_model_combined_prompt = """
@@ -84,16 +229,17 @@ class EmailSummariser:
         
         The user will provide you with a message to categorize and summarise. This message will have been received 
         within the previous <HOURS_TO_FETCH> hours.
-        """.replace('<HOURS_TO_FETCH>', str(self.HOURS_TO_FETCH))
+        """.replace('<HOURS_TO_FETCH>', str(self.HOURS_TO_FETCH)).replace(
+            '{allowed_categories_list}', ', '.join(allowed_categories_list))
 
         self.ai_model_top_headlines_prompt = """
         You are an expert scriptwriter for a news radio station. 
         Create engaging and informative news headlines from the emails received in the past <HOURS_TO_FETCH> hours. 
         Your summary should be a paragraph suitable for a news bulletin opening. Be fluid and expressive, and don't include 
         any bullet points or lists. Make it easy for the newsreader to present the information.
-        Highlight any significant news. Your script will be read out at <TIME_STRING> so phrase 'morning', 'afternoon' and other time-based words accordingly as needed.  
+        Highlight any significant news. The user's message ends with the time your script will be read out, so phrase 'morning', 'afternoon' and other time-based words accordingly as needed.  
         Conclude with your own observations on the messages, starting with "In my opinion..."."
-        """.replace('<HOURS_TO_FETCH>', str(self.HOURS_TO_FETCH)).replace('<TIME_STRING>', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        """.replace('<HOURS_TO_FETCH>', str(self.HOURS_TO_FETCH))
 
 
         self.ai_model_category_headlines_prompt = """
@@ -101,12 +247,12 @@ class EmailSummariser:
         Condense the emails received in the past <HOURS_TO_FETCH> hours into an engaging and informative 
         single-paragraph news bulletin summary, highlighting noteworthy points even if the emails seem mundane. 
         Be concise, use British English spelling. Make it easy for the newsreader to present the information.
-        Your escript will be read out at <TIME_STRING> so phrase 'morning', 'afternoon' and other time-based words accordingly as needed.  
+        The user's message ends with the time your script will be read out, so phrase 'morning', 'afternoon' and other time-based words accordingly as needed.  
         and conclude with your personal observations starting with "In my opinion...".
         Start your output with the actual script. NO need to say 'Good morning / evening' or 'This is the news' or
         'Here are the headlines' or similar. No I'm [Newsreader] or similar. Just the news. This is so that your
         paragraph and opinion can be used in the middle of a larger script of which your output forms part.
-        """.replace('<HOURS_TO_FETCH>', str(self.HOURS_TO_FETCH)).replace('<TIME_STRING>', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        """.replace('<HOURS_TO_FETCH>', str(self.HOURS_TO_FETCH))
 
         self.ai_model_concluding_summary_prompt = """
         You are an expert scriptwriter for a news radio station. 
@@ -118,29 +264,28 @@ class EmailSummariser:
         Start this list with "Top 10 messages to read first:"
         """.replace('<HOURS_TO_FETCH>', str(self.HOURS_TO_FETCH))
 
-        self.ai_model_convert_html_to_plain_text_prompt = """
-        You are an expert at converting HTML content to plain text. There is no need to retain any formatting or links,
-        just return the plain text content. The user will provide you with an HTML message to convert.
+        # Added to a prompt when the answers to the chunks of a long text are combined into one answer
+        self.ai_model_combine_parts_note = """
+        The content was too long to read at once, so it was split into parts and you have already answered each part.
+        The user will provide those answers. Combine them into a single answer that follows the instructions above,
+        covering every part without repeating yourself.
         """
 
-    def add_categories_to_prompt(self):
-        self.ai_model_combined_prompt = self.ai_model_combined_prompt.replace(
-            '{allowed_categories_list}', ', '.join(allowed_categories_list))
+        # Shared with ollama_convert_html_to_plain_text.py so that both scripts hit the same response cache entries
+        self.ai_model_convert_html_to_plain_text_prompt = ai_prompt_convert_html_to_plain_text
 
     @staticmethod
     def format_body(body_text: str) -> str:
         # replace all '\uXXXX' characters with a space
         processed_text = body_text.encode('ascii', 'ignore').decode('ascii')
 
-        # Remove any web addresses by searching for 'https', 'http' and 'www', then removing the text up to the next space
-        processed_text = ' '.join([word for word in processed_text.split() if
-                                   'https' not in word and 'http' not in word and 'www' not in word])
+        # Remove any web addresses by searching for 'https', 'http' and 'www', then removing the text up to the next space.
+        # Extra spaces are removed too, but line breaks are kept so a long message can be split between paragraphs.
+        lines = [' '.join(word for word in line.split() if 'https' not in word and 'http' not in word and
+                          'www' not in word) for line in processed_text.splitlines()]
 
-        # remove any extra spaces
-        while '  ' in processed_text:
-            processed_text = processed_text.replace('  ', ' ')
-
-        return processed_text
+        # Runs of blank lines become a single blank line between paragraphs
+        return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
 
     def get_gmail_messages(self):
         if not self.gmail_account_username or not self.gmail_account_password:
@@ -157,7 +302,10 @@ class EmailSummariser:
         return messages_list
 
     def connect_to_server(self):
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
+        if self.MAIL_USE_SSL:
+            mail = imaplib.IMAP4_SSL(self.IMAP_SERVER, self.IMAP_PORT)
+        else:
+            mail = imaplib.IMAP4(self.IMAP_SERVER, self.IMAP_PORT)
         mail.login(self.gmail_account_username, self.gmail_account_password)
         return mail
 
@@ -168,26 +316,78 @@ class EmailSummariser:
                 print("Error selecting inbox!")
                 return []
 
-            date_hours_ago = (datetime.now() - timedelta(hours=self.HOURS_TO_FETCH)).strftime('%d-%b-%Y')
-            search_criteria = f'(SINCE {date_hours_ago})'
-            status, data = mail.search(None, search_criteria)
+            # UIDVALIDITY is only needed to pick up where the last run left off, so a server that does not send it
+            # only rules out an incremental sync
+            uid_validity = None
+            if self.INCREMENTAL_SYNC:
+                uid_validity_response = mail.response('UIDVALIDITY')[1]
+                if uid_validity_response and uid_validity_response[0]:
+                    uid_validity = int(uid_validity_response[0])
+                else:
+                    print('The server did not report the mailbox UIDVALIDITY - the sync state will not be used')
+            sync_state = self.load_sync_state() if uid_validity is not None else {}
+
+            if (sync_state.get('username') == self.gmail_account_username and
+                    sync_state.get('uid_validity') == uid_validity):
+                # Only ask for messages that have arrived since the last run
+                last_uid = sync_state['last_uid']
+                search_criteria = f'(UID {last_uid + 1}:*)'
+            else:
+                if self.INCREMENTAL_SYNC:
+                    print('No matching sync state for this mailbox - performing a full sync')
+                last_uid = 0
+                date_hours_ago = (datetime.now() - timedelta(hours=self.HOURS_TO_FETCH)).strftime('%d-%b-%Y')
+                search_criteria = f'(SINCE {date_hours_ago})'
+
+            status, data = mail.uid('SEARCH', None, search_criteria)
             if status != 'OK':
                 print("No messages found!")
                 return []
 
-            message_ids = data[0].split()
+            # A search for 'UID n:*' always returns the newest message, even if it was seen by the last run
+            message_ids = [int(uid) for uid in data[0].split() if int(uid) > last_uid]
+
+            if uid_validity is not None:
+                self.pending_sync_state = {
+                    'username': self.gmail_account_username,
+                    'uid_validity': uid_validity,
+                    'last_uid': max(message_ids, default=last_uid)
+                }
             return message_ids
         except Exception as e:
             print(f'Error fetching message IDs: {e}')
             return []
 
-    def fetch_messages(self, mail, message_id_list):
-        email_list = []
-        for current_email_id in message_id_list:
-            msg = fetch_email_by_id(mail, current_email_id)
-            msg_data = self.extract_email_data(msg)
-            print('.', end='', flush=True)
-            email_list.append(msg_data)
+    def load_sync_state(self) -> dict:
+        try:
+            with open(self.IMAP_STATE_FILE, 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f'Error reading sync state file {self.IMAP_STATE_FILE}: {e}')
+            return {}
+
+    def save_sync_state(self):
+        if not self.INCREMENTAL_SYNC or not self.pending_sync_state:
+            return
+
+        try:
+            with open(self.IMAP_STATE_FILE, 'w') as file:
+                json.dump(self.pending_sync_state, file)
+            print('Sync state saved - the next run will start after message UID', self.pending_sync_state['last_uid'])
+        except Exception as e:
+            print(f'Error saving sync state file {self.IMAP_STATE_FILE}: {e}')
+
+    def fetch_message_headers(self, mail, message_id_list):
+        return [self.extract_email_data(msg, email_id) for email_id, msg in
+                fetch_emails_by_ids(mail, message_id_list, IMAP_HEADER_FIELDS, self.IMAP_FETCH_BATCH_SIZE)]
+
+    def fetch_message_bodies(self, mail, email_list):
+        email_index = {msg_data.imap_id: msg_data for msg_data in email_list}
+        for email_id, msg in fetch_emails_by_ids(mail, list(email_index), "(RFC822)", self.IMAP_FETCH_BATCH_SIZE):
+            if email_id in email_index:
+                self.extract_email_body(email_index[email_id], msg)
         return email_list
 
     def filter_recent_emails(self, email_list):
@@ -195,39 +395,30 @@ class EmailSummariser:
         recent_emails = []
 
         for msg_data in email_list:
-            if not msg_data['date_sent']:
-                continue
-
-            try:
-                email_date = datetime.strptime(msg_data['date_sent'], '%a, %d %b %Y %H:%M:%S %z')
-                if email_date < date_hours_ago:
-                    continue
-            except:
+            # The date was parsed once when the message was extracted - None means it was missing or unreadable
+            email_date = msg_data.date_sent_datetime
+            if email_date is None or email_date < date_hours_ago:
                 continue
 
             recent_emails.append(msg_data)
         return recent_emails
 
     def filter_ignored_senders(self, email_list):
-        filtered_emails = [msg for msg in email_list if msg['sender'] not in self.ignore_sender_list]
+        filtered_emails = [msg for msg in email_list if msg.sender not in self.ignore_sender_list]
         return filtered_emails
 
     def deduplicate_emails(self, email_list):
         deduped_email_list = []
-        sorted_email_list = sorted(
-            email_list,
-            key=lambda x: datetime.strptime(x['date_sent'], '%a, %d %b %Y %H:%M:%S %z'),
-            reverse=True
-        )
+        seen_sender_subjects = set()
+        sorted_email_list = sorted(email_list, key=lambda x: x.date_sent_datetime, reverse=True)
 
         before_deduped_count = len(sorted_email_list)
 
+        # Keep the most recent message for each (sender, subject) pair
         for message in sorted_email_list:
-
-            if not any(
-                    message['sender'] == deduped_email['sender'] and message['subject'] == deduped_email['subject']
-                    for deduped_email in deduped_email_list
-            ):
+            sender_subject = (message.sender, message.subject)
+            if sender_subject not in seen_sender_subjects:
+                seen_sender_subjects.add(sender_subject)
                 deduped_email_list.append(message)
 
         after_deduped_count = len(deduped_email_list)
@@ -239,10 +430,13 @@ class EmailSummariser:
 
     def fetch_and_filter_messages(self, mail, message_id_list):
         try:
-            email_list = self.fetch_messages(mail, message_id_list)
+            # Phase one: fetch only the headers so that the filters can discard messages before their bodies
+            # are downloaded. Phase two: fetch the bodies of the messages that are left.
+            email_list = self.fetch_message_headers(mail, message_id_list)
             email_list = self.filter_recent_emails(email_list)
             email_list = self.filter_ignored_senders(email_list)
             email_list = self.deduplicate_emails(email_list)
+            email_list = self.fetch_message_bodies(mail, email_list)
 
             print(f'{len(email_list)} messages found with readable text in the body of the message')
             return email_list
@@ -252,7 +446,7 @@ class EmailSummariser:
             print('Traceback:', e.__traceback__.tb_lineno)
             return []
 
-    def extract_email_data(self, msg) -> dict:
+    def extract_email_data(self, msg, imap_id=None) -> MessageRecord:
         try:
             subject = self.decode_mime_header(msg["Subject"]).replace('\n', '')
         except:
@@ -273,22 +467,24 @@ class EmailSummariser:
         except:
             date_sent = '(unknown date)'
 
+        return MessageRecord(message_id, date_sent, sender, subject, imap_id)
+
+    def extract_email_body(self, msg_data: MessageRecord, msg):
         try:
             plain_text, html = self.extract_body(msg)
         except:
             plain_text = ''
             html = ''
 
-        return {
-            'message_id': message_id,
-            'date_sent': date_sent,
-            'sender': sender,
-            'subject': subject,
-            'plain_text': self.format_body(plain_text),
-            'html': html,
-            'summary': '',
-            'category': 'UNPROCESSED'
-        }
+        msg_data.plain_text = self.format_body(plain_text)
+        if not msg_data.plain_text and html:
+            msg_data.plain_text = self.format_body(convert_html_to_plain_text(html))
+            if not is_readable_conversion(msg_data.plain_text):
+                msg_data.plain_text = ''
+                if self.AI_HTML_FALLBACK:
+                    # Keep the HTML for the AI model to convert instead. Without the fallback nothing could use it,
+                    # so it is not held in memory for the rest of the run.
+                    msg_data.html = html
 
     @staticmethod
     def decode_mime_header(header_value: str) -> str:
@@ -304,50 +500,210 @@ class EmailSummariser:
 
         def decode_payload(encoded_payload):
             if encoded_payload:
-                decoded_payload = encoded_payload.decode(errors='ignore')
-                if '<html' not in decoded_payload:
-                    return decoded_payload + "\n"
+                return encoded_payload.decode(errors='ignore') + "\n"
             return ''
 
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                if "text/plain" in content_type:
-                    payload = part.get_payload(decode=True)
-                    plain_text += decode_payload(payload)
-                elif "text/html" in content_type:
-                    payload = part.get_payload(decode=True)
-                    html += decode_payload(payload)
-        else:
-            payload = msg.get_payload(decode=True)
-            plain_text += decode_payload(payload)
+        parts = msg.walk() if msg.is_multipart() else [msg]
+        for part in parts:
+            content_type = part.get_content_type()
+            if "text/plain" in content_type or "text/html" in content_type:
+                payload = decode_payload(part.get_payload(decode=True))
+                # Some senders label HTML as plain text, so look at the content as well as the content type
+                if "text/html" in content_type or '<html' in payload:
+                    html += payload
+                else:
+                    plain_text += payload
 
         return plain_text, html
 
-    def ai_summarise_email(self, email_content: str) -> str:
-        response = ollama.chat(
+    def get_ai_response(self, call_site: str, validate_category: bool = False, max_response_chars: int = None,
+                        **kwargs) -> tuple:
+        # Returns the response content and whether the response is complete (False if streaming stopped it early).
+        # Only responses that can be used when cut short, such as message summaries, should set max_response_chars.
+        with self.ai_request_semaphore:
+            if not self.STREAM_RESPONSES:
+                return ollama_client.chat(call_site, **kwargs)['message']['content'], True
+            return self.stream_ai_response(call_site, validate_category, max_response_chars, **kwargs)
+
+    def stream_ai_response(self, call_site: str, validate_category: bool, max_response_chars: int,
+                           **kwargs) -> tuple:
+        start_time = time.perf_counter()
+        first_token_time = None
+        content = ''
+        chunk_count = 0
+        eval_count = None
+        abort_reason = ''
+
+        stream = ollama_client.chat(call_site, stream=True, **kwargs)
+        try:
+            for chunk in stream:
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                content += chunk['message']['content']
+                chunk_count += 1
+                if chunk.get('done'):
+                    eval_count = chunk.get('eval_count')
+
+                if max_response_chars and len(content) > max_response_chars:
+                    abort_reason = f'response longer than {max_response_chars} characters'
+                    break
+
+                # The category is the first word of the response, followed by a colon
+                if validate_category and (':' in content or len(content.strip()) > 20):
+                    if content.split(':')[0].strip().upper() not in allowed_categories_list:
+                        abort_reason = f'invalid category line "{content.strip()[:30]}"'
+                        break
+                    validate_category = False
+        finally:
+            # Closing the stream drops the connection, which tells Ollama to stop generating
+            stream.close()
+
+        end_time = time.perf_counter()
+        metrics = {
+            'model': kwargs.get('model'),
+            'time_to_first_token': (first_token_time or end_time) - start_time,
+            # Ollama streams one token per chunk, and only reports eval_count in the final chunk
+            'tokens': eval_count or chunk_count,
+            'generation_seconds': end_time - (first_token_time or end_time),
+            'aborted': bool(abort_reason)
+        }
+        self.stream_metrics_list.append(metrics)
+
+        if abort_reason:
+            print(f'\t\t\tStopped generation early: {abort_reason}')
+        return content, not abort_reason
+
+    def print_stream_metrics(self):
+        if not self.stream_metrics_list:
+            return
+
+        call_count = len(self.stream_metrics_list)
+        mean_ttft = sum(m['time_to_first_token'] for m in self.stream_metrics_list) / call_count
+        total_tokens = sum(m['tokens'] for m in self.stream_metrics_list)
+        total_generation_seconds = sum(m['generation_seconds'] for m in self.stream_metrics_list)
+        aborted_count = sum(1 for m in self.stream_metrics_list if m['aborted'])
+        tokens_per_second = total_tokens / total_generation_seconds if total_generation_seconds > 0 else 0
+
+        print(f'Streaming: {call_count} calls, mean time to first token {round(mean_ttft, 2)} seconds, '
+              f'{round(tokens_per_second, 1)} tokens per second, {aborted_count} generations stopped early')
+
+    def get_max_user_content_tokens(self, prompt: str) -> int:
+        # The space left in the context window once the system prompt and the model's response are allowed for
+        return max(500, self.NUM_CTX - estimate_tokens(prompt) - self.RESPONSE_TOKEN_RESERVE)
+
+    def map_chunks(self, function, chunks: list) -> list:
+        # Process the chunks of a long text concurrently, returning the results in the original chunk order
+        with ThreadPoolExecutor(max_workers=max(1, self.MAX_CONCURRENT_REQUESTS)) as executor:
+            return list(executor.map(function, chunks))
+
+    def ai_summarise_email(self, email_content: str, reduce_level: int = 0) -> str:
+        max_tokens = self.get_max_user_content_tokens(self.ai_model_combined_prompt)
+        if estimate_tokens(email_content) <= max_tokens:
+            return self.ai_summarise_text(email_content)
+
+        # The message would be truncated by the model, so summarise it in chunks and then summarise the summaries
+        chunks = split_text_into_chunks(email_content, max_tokens)
+        if reduce_level >= MAX_REDUCE_LEVELS:
+            print(f'Message summaries are still about {estimate_tokens(email_content)} tokens after '
+                  f'{MAX_REDUCE_LEVELS} rounds of summarising - summarising the first part only')
+            return self.ai_summarise_text(chunks[0])
+        print(f'Message is about {estimate_tokens(email_content)} tokens - summarising it in {len(chunks)} chunks')
+        chunk_responses = self.map_chunks(self.ai_summarise_text, chunks)
+
+        chunk_categories = []
+        chunk_summaries = []
+        for chunk_response in chunk_responses:
+            category, _, summary = chunk_response.partition(':')
+            category = category.strip().upper()
+            if category in allowed_categories_list and summary.strip():
+                chunk_categories.append(category)
+                chunk_summaries.append(summary.strip())
+
+        if not chunk_summaries:
+            return chunk_responses[0]
+
+        # The summaries of the chunks are much shorter than the message, but are reduced again if still too long
+        response = self.ai_summarise_email('\n\n'.join(chunk_summaries), reduce_level + 1)
+        category, _, summary = response.partition(':')
+        if category.strip().upper() not in allowed_categories_list:
+            # Fall back to the category chosen for most of the chunks
+            response = Counter(chunk_categories).most_common(1)[0][0] + ': ' + (summary or response).strip()
+        return response
+
+    def ai_summarise_text(self, email_content: str) -> str:
+        cached_response = self.response_cache.get(self.summarising_ai_model, self.ai_model_combined_prompt,
+                                                  email_content)
+        if cached_response is not None:
+            return cached_response
+
+        response, complete = self.get_ai_response(
+            'email_summariser.summarise_email',
+            validate_category=True,
+            max_response_chars=self.MAX_RESPONSE_CHARS,
             model=self.summarising_ai_model,
             options={"num_ctx": self.NUM_CTX},
             messages=[
                 {'role': 'system', 'content': self.ai_model_combined_prompt},
                 {'role': 'user', 'content': email_content},
             ])
-        return response['message']['content'].strip().replace('\n', '.')
-
-    def call_ai_model(self, model, prompt, user_content):
-        response = ollama.chat(
+        response = response.strip().replace('\n', '.')
+
+        # Only cache responses with a valid category, so that messages the AI did not understand are retried next run
+        if complete and response.split(':')[0].strip().upper() in allowed_categories_list:
+            self.response_cache.put(self.summarising_ai_model, self.ai_model_combined_prompt, email_content, response)
+        return response
+
+    def call_ai_model(self, model, prompt, user_content, call_site='email_summariser.call_ai_model',
+                      user_content_suffix='', combine_chunks=True, reduce_level=0):
+        # user_content_suffix is added to the end of every chunk sent, after the content itself
+        max_tokens = self.get_max_user_content_tokens(prompt) - (
+            estimate_tokens(user_content_suffix) if user_content_suffix else 0)
+        if estimate_tokens(user_content) <= max_tokens:
+            return self.call_ai_model_once(model, prompt, user_content + user_content_suffix, call_site)
+
+        chunks = split_text_into_chunks(user_content, max_tokens)
+        if reduce_level >= MAX_REDUCE_LEVELS:
+            print(f'Content is still about {estimate_tokens(user_content)} tokens after {MAX_REDUCE_LEVELS} rounds '
+                  f'of combining - sending the first part only')
+            return self.call_ai_model_once(model, prompt, chunks[0] + user_content_suffix, call_site)
+
+        # Too long for the context window - process the content in chunks, keeping the responses in order
+        print(f'Content is about {estimate_tokens(user_content)} tokens - sending it in {len(chunks)} chunks')
+        chunk_responses = self.map_chunks(
+            lambda chunk: self.call_ai_model_once(model, prompt, chunk + user_content_suffix, call_site), chunks)
+        if not combine_chunks:
+            return '\n\n'.join(chunk_responses)
+
+        # Each response only covers part of the content, so they are combined into one response (a conclusion or a
+        # set of headlines) rather than one for each chunk
+        combine_prompt = prompt if reduce_level else prompt + self.ai_model_combine_parts_note
+        return self.call_ai_model(model, combine_prompt, '\n\n'.join(chunk_responses), call_site,
+                                  user_content_suffix, reduce_level=reduce_level + 1)
+
+    def call_ai_model_once(self, model, prompt, user_content, call_site):
+        cached_response = self.response_cache.get(model, prompt, user_content)
+        if cached_response is not None:
+            return cached_response
+
+        response, complete = self.get_ai_response(
+            call_site,
             model=model, options={"num_ctx": self.NUM_CTX},
             messages=[
                 {'role': 'system', 'content': prompt},
                 {'role': 'user', 'content': user_content},
             ])
+        response = response.strip()
 
-        return response['message']['content'].strip()
+        if complete:
+            self.response_cache.put(model, prompt, user_content, response)
+        return response
 
     def ai_convert_html_to_plain_text(self, email_content: str) -> str:
         try:
+            # Each chunk converts its own part of the HTML, so the chunks' text is joined rather than combined
             plain_text = self.call_ai_model(self.summarising_ai_model, self.ai_model_convert_html_to_plain_text_prompt,
-                                            email_content)
+                                            email_content, 'email_summariser.convert_html_to_plain_text',
+                                            combine_chunks=False)
             return plain_text.replace('\n', '. ').replace('..', '.').strip()
         except Exception as e:
             print('Error converting HTML to plain text: ', e)
@@ -355,12 +711,13 @@ class EmailSummariser:
 
     def ai_author_category_headlines(self, email_message_list: list) -> str:
         content = ''.join(
-            f"From: {message_data['sender']}\nSubject: {message_data['subject']}\nMessage: {message_data['summary']}\n\n"
+            f"From: {message_data.sender}\nSubject: {message_data.subject}\nMessage: {message_data.summary}\n\n"
             for message_data in email_message_list)
 
         try:
             ai_response = self.call_ai_model(
-                self.summarising_ai_model, self.ai_model_category_headlines_prompt, content
+                self.summarising_ai_model, self.ai_model_category_headlines_prompt, content,
+                'email_summariser.category_headlines', self.read_out_time_note
             ).replace('\n', '. ')
 
             ai_response_sentences = [sentence for sentence in ai_response.split('. ') if
@@ -384,7 +741,8 @@ class EmailSummariser:
         print('Authoring concluding paragraph...')
         try:
             paragraph = self.call_ai_model(
-                self.summarising_ai_model, self.ai_model_concluding_summary_prompt, email_body_text
+                self.summarising_ai_model, self.ai_model_concluding_summary_prompt, email_body_text,
+                'email_summariser.concluding_paragraph'
             )
             return format_concluding_paragraph(paragraph)
 
@@ -396,7 +754,8 @@ class EmailSummariser:
         print('Authoring top headlines summary...')
         try:
             headlines = self.call_ai_model(
-                self.summarising_ai_model, self.ai_model_top_headlines_prompt, summarised_group_content
+                self.summarising_ai_model, self.ai_model_top_headlines_prompt, summarised_group_content,
+                'email_summariser.overall_headlines', self.read_out_time_note
             )
             # Put in two line breaks every fourth sentence to make the text more readable
             headlines = '.<br><br>'.join([sentence for i, sentence in enumerate(headlines.split('. ')) if i % 4 != 0])
@@ -406,22 +765,64 @@ class EmailSummariser:
             return ''
 
     def update_message_list(self, message_id: str, summary: str):
-        for message in self.messages_data['messages_list']:
-            if message['message_id'] == message_id:
-                message['summary'] = summary
-                break
+        message = self.messages_data['messages_index'].get(message_id)
+        if message is not None:
+            message.summary = summary
+
+    def author_category_section(self, section_name: str, batch_messages: list, category_message_count: int) -> str:
+        print(f'Processing category: {section_name} - {len(batch_messages)} of {category_message_count} messages...')
+        self.messages_data['category_summary_dict'][section_name] = self.ai_author_category_headlines(batch_messages)
+        return self.messages_data['category_summary_dict'][section_name]
+
+    def merge_similar_messages(self, messages_by_category: dict) -> dict:
+        # Replaces each cluster of messages with similar summaries by one entry, within each category. Every summary
+        # is embedded up front, so the embedding requests are batched across all the categories.
+        if not self.semantic_clusterer.enabled:
+            return messages_by_category
+
+        # A resumed attempt reuses the clusters of the first, so its sections (and the ones already in
+        # category_summary_dict) are the same and no summaries are embedded again
+        if 'merged_messages_by_category' in self.messages_data:
+            return self.messages_data['merged_messages_by_category']
+
+        messages = [message for category_messages in messages_by_category.values() for message in category_messages]
+        if not messages:
+            return messages_by_category
+        try:
+            embeddings = self.semantic_clusterer.embed_texts([message.summary for message in messages],
+                                                             'email_summariser.semantic_clustering')
+        except Exception as e:
+            print('Error embedding summaries - every message will be kept on its own:', e)
+            return messages_by_category
+
+        merged_messages_by_category = {}
+        start_index = 0
+        for category, category_messages in messages_by_category.items():
+            category_embeddings = embeddings[start_index:start_index + len(category_messages)]
+            start_index += len(category_messages)
+            merged_messages_by_category[category] = [
+                merge_message_cluster([category_messages[i] for i in cluster])
+                for cluster in self.semantic_clusterer.cluster_embeddings(category_embeddings)]
+        self.messages_data['merged_messages_by_category'] = merged_messages_by_category
+        return merged_messages_by_category
+
+    @staticmethod
+    def add_headlines_summary(sections_body: str, headlines_summary: str) -> str:
+        if not headlines_summary:
+            return '<p>' + sections_body + '</p>'
+        return '<p>Overall Headline Summary:<br>' + headlines_summary + '<br><br>' + sections_body + '</p>'
 
     def author_summary_email(self, email_list: list) -> tuple:
         try:
-            earliest_message = email_list[0]["date_sent"]
-            latest_message = email_list[-1]["date_sent"]
+            earliest_message = email_list[0].date_sent
+            latest_message = email_list[-1].date_sent
 
             email_body = f"<p>Here are the AI-powered summaries of the emails from {earliest_message} to {latest_message}:<br><br></p>"
             revised_categories_list = []
 
             for message in email_list:
-                if message['category'] != 'UNPROCESSED' and message['category'] not in revised_categories_list:
-                    revised_categories_list.append(message['category'])
+                if message.category != 'UNPROCESSED' and message.category not in revised_categories_list:
+                    revised_categories_list.append(message.category)
 
             if 'PERSONAL' in revised_categories_list:
                 revised_categories_list.remove('PERSONAL')
@@ -431,61 +832,74 @@ class EmailSummariser:
                 revised_categories_list.remove('NEWS')
                 revised_categories_list.insert(1, 'NEWS')
 
-            category_counter = 0
+            category_summary_dict = self.messages_data.setdefault('category_summary_dict', {})
 
-            if 'category_summary_dict' not in self.messages_data or not self.messages_data.get('category_summary_dict'):
-                self.messages_data['category_summary_dict'] = {}
+            # Each category is summarised in one section, or in sections of 10 messages for larger categories.
+            # With SEMANTIC_CLUSTERING, messages with similar summaries are first merged into one entry each.
+            # Sections that have already been processed are taken from category_summary_dict.
+            messages_by_category = {category: [message for message in email_list if message.category == category]
+                                    for category in revised_categories_list}
+            merged_messages_by_category = self.merge_similar_messages(messages_by_category)
 
+            category_sections = {}
+            tasks = {}
             for category in revised_categories_list:
-                filtered_messages_list = [message for message in email_list if message["category"] == category]
-                if category not in self.messages_data.get('category_summary_dict', {}) or self.messages_data['category_summary_dict'][category] == '':
-                    category_counter += 1
-                    print(f'Processing category: {category} ({category_counter} of {len(revised_categories_list)}) - {len(filtered_messages_list)} messages...')
-                    if len(filtered_messages_list) <= 10:
-                        self.messages_data['category_summary_dict'][category] = self.ai_author_category_headlines(filtered_messages_list)
-                        email_body += f'<hr>Category: {category} (from {len(filtered_messages_list)} messages)<br>'
-                        email_body += self.messages_data['category_summary_dict'][category]
-                    else:
-                        # process messages in batches of 10
-                        group_counter = 1
-                        for i in range(0, len(filtered_messages_list), 10):
-                            batch_messages = filtered_messages_list[i:i + 10]
-                            category_group_name = f'{category}-{group_counter}'
-                            if f'{category}-{group_counter}' in self.messages_data['category_summary_dict']:
-                                self.messages_data['category_summary_dict'][category_group_name] += self.ai_author_category_headlines(batch_messages)
-                            else:
-                                self.messages_data['category_summary_dict'][category_group_name] = self.ai_author_category_headlines(batch_messages)
-
-                            email_body += f'<hr>Category: {category_group_name} (from {len(filtered_messages_list)} messages)<br>'
-                            email_body += self.messages_data['category_summary_dict'][category_group_name]
-                            group_counter += 1
-
-                email_body += '\n\n'
-
-            if self.NEWSREADER_SCRIPT and (
-                    'headlines_summary' not in self.messages_data.get('headlines_summary', {}) or self.messages_data[
-                'headlines_summary'] == ''):
-                self.messages_data['headlines_summary'] = self.ai_author_overall_headlines(email_body)
-
-            email_body = '<p>Overall Headline Summary:<br>' + self.messages_data[
-                'headlines_summary'] + '<br><br>' + email_body + '</p>'
-
-            if 'concluding_paragraph' not in self.messages_data.get('concluding_paragraph', {}) or self.messages_data[
-                'concluding_paragraph'] == '':
-                self.messages_data['concluding_paragraph'] = self.ai_author_concluding_paragraph(email_body)
-
-            email_body += '<hr>Concluding Paragraph:<br>' + self.messages_data['concluding_paragraph']
+                message_count = len(messages_by_category[category])
+                filtered_messages_list = merged_messages_by_category[category]
+                if len(filtered_messages_list) <= 10:
+                    batches = [(category, filtered_messages_list)]
+                else:
+                    batches = [(f'{category}-{group_counter}', filtered_messages_list[i:i + 10])
+                               for group_counter, i in enumerate(range(0, len(filtered_messages_list), 10), start=1)]
+
+                category_sections[category] = [(section_name, message_count) for section_name, _ in batches]
+                for section_name, batch_messages in batches:
+                    if not category_summary_dict.get(section_name):
+                        tasks[section_name] = (self.author_category_section,
+                                               [section_name, batch_messages, message_count], [])
+
+            def assemble_category_sections(*_section_results):
+                # Sections are added in category order, whatever order their AI requests finished in
+                sections_body = email_body
+                for category in revised_categories_list:
+                    for section_name, message_count in category_sections[category]:
+                        sections_body += f'<hr>Category: {section_name} (from {message_count} messages)<br>'
+                        sections_body += category_summary_dict[section_name]
+                    sections_body += '\n\n'
+                return sections_body
+
+            def author_headlines_summary(sections_body):
+                if self.NEWSREADER_SCRIPT and not self.messages_data.get('headlines_summary'):
+                    self.messages_data['headlines_summary'] = self.ai_author_overall_headlines(sections_body)
+                return self.messages_data.get('headlines_summary', '')
+
+            def author_concluding_paragraph(sections_body, headlines_summary):
+                if not self.messages_data.get('concluding_paragraph'):
+                    self.messages_data['concluding_paragraph'] = self.ai_author_concluding_paragraph(
+                        self.add_headlines_summary(sections_body, headlines_summary))
+                return self.messages_data['concluding_paragraph']
+
+            # The category sections are independent of each other so run concurrently; the overall headlines
+            # and concluding paragraph start once the sections they summarise are ready.
+            tasks['category_sections'] = (assemble_category_sections, [], list(tasks))
+            tasks['headlines_summary'] = (author_headlines_summary, [], ['category_sections'])
+            tasks['concluding_paragraph'] = (author_concluding_paragraph, [],
+                                             ['category_sections', 'headlines_summary'])
+            results = run_task_graph(tasks, self.MAX_CONCURRENT_REQUESTS)
+
+            email_body = self.add_headlines_summary(results['category_sections'], results['headlines_summary'])
+            email_body += '<hr>Concluding Paragraph:<br>' + results['concluding_paragraph']
 
             if self.INDIVIDUAL_EMAIL_SUMMARIES:
                 email_body += '<hr>Individual Email Summaries:<br>'
                 for category in revised_categories_list:
-                    filtered_messages_list = [message for message in email_list if message["category"] == category]
+                    filtered_messages_list = [message for message in email_list if message.category == category]
                     email_body += f'----------------------------------------<br>{category}<br>'
                     for message in filtered_messages_list:
                         email_body += '----------------------------------------<br><br>'
-                        email_body += f"From: {message['sender']} on {message['date_sent']} with subject '{message['subject']}':<br>"
-                        email_body += f"Category: {message['category']}<br>"
-                        email_body += f"Summary: {message['summary']}<br><br>"
+                        email_body += f"From: {message.sender} on {message.date_sent} with subject '{message.subject}':<br>"
+                        email_body += f"Category: {message.category}<br>"
+                        email_body += f"Summary: {message.summary}<br><br>"
 
             return email_body, earliest_message, latest_message
 
@@ -501,7 +915,8 @@ class EmailSummariser:
             exit(1)
 
         try:
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
+            smtp_class = smtplib.SMTP_SSL if self.MAIL_USE_SSL else smtplib.SMTP
+            with smtp_class(self.SMTP_SERVER, self.SMTP_PORT) as server:
                 server.login(self.gmail_account_username, self.gmail_account_password)
                 msg = email.message.EmailMessage()
                 msg['Subject'] = f'Summary of messages from {earliest_datetime} to {latest_datetime}'
@@ -510,35 +925,72 @@ class EmailSummariser:
                 msg.add_alternative(email_body, subtype='html')
                 server.send_message(msg)
                 print('Summary email sent successfully')
+                return True
         except Exception as e:
             print('Error sending summary email:', e)
+            return False
 
 
     def wake_up_ai(self):
         print('Waking up AI models...')
         try:
-            response = ollama.chat(
-                model=self.summarising_ai_model,
-                messages=[
-                    {'role': 'system',
-                     'content': 'The user will send you a "wake up" message. Just respond with a pleasantry!'},
-                    {'role': 'user', 'content': 'Hello AI, this is a test message to wake you up! I hope you are well!'}
-                ])
-
-            print(f'AI model "{self.summarising_ai_model}" is awake and says: {response["message"]["content"]}')
-
-            response = ollama.chat(
-                model=self.categorising_ai_model,
-                messages=[
-                    {'role': 'system',
-                     'content': 'The user will send you a "wake up" message. Just respond with a pleasantry!'},
-                    {'role': 'user', 'content': 'Hello AI, this is a test message to wake you up! I hope you are well!'}
-                ])
-
-            print(f'AI model "{self.categorising_ai_model}" is awake and says: {response["message"]["content"]}')
+            # Loading a model does not need a reply from it, so no tokens are generated here
+            for ai_model in dict.fromkeys([self.summarising_ai_model, self.categorising_ai_model]):
+                for host_url, response in ollama_client.warm_up('email_summariser.wake_up_ai', ai_model):
+                    load_seconds = (response.get('load_duration') or 0) / ollama_metrics.NANOSECONDS_PER_SECOND
+                    print(f'AI model "{ai_model}" is awake on {host_url} (loaded in {round(load_seconds, 1)} seconds)')
         except Exception as e:
             print(f'Error waking up AI models: {e}')
 
+    def summarise_message(self, message: MessageRecord, process_counter: int):
+        try:
+            # 'UNPROCESSED' is the initial category for all messages
+            if message.category == 'UNPROCESSED':
+                if len(message.plain_text) > 0:
+                    email_text = message.plain_text
+                elif len(message.html) > 0 and self.AI_HTML_FALLBACK:
+                    # The local converter could not produce readable text from this message's HTML
+                    print('Converting HTML to plain text using AI')
+                    email_text = self.ai_convert_html_to_plain_text(message.html)
+                    # Keep the converted text instead of the much larger HTML for the rest of the run
+                    message.plain_text = email_text
+                    message.html = ''
+                else:
+                    email_text = ''
+
+                if len(email_text) < 100:
+                    print('Email content too short to summarise')
+                else:
+                    # Each line is printed with a single call so output from concurrent requests does not interleave
+                    print(f'Processing message: {process_counter} of {len(self.messages_data["messages_list"])} - '
+                          f'{round(len(email_text) / 1000, 1)} Kb from {message.sender}'
+                          f'\n\t\t\twith subject: {message.subject}')
+
+                    # If the category is empty, 'UNOPROCESSED' or contains a space, get the AI to summarise the email
+                    # and if necessary, re-summarise it!
+                    while message.category not in allowed_categories_list:
+                        response = self.ai_summarise_email(email_text)
+
+                        # The frst word of the response is the category
+                        message.category = response.split(':')[0].strip().upper()
+
+                        # If the category is not in the allowed list, the AI has not understood the
+                        # email (or the content fell foul of the model's moral filters, so delete the summary.
+                        if message.category not in allowed_categories_list:
+                            message.category = 'UNPROCESSED'
+                            message.summary = '(AI did not understand the email content)'
+                            break
+
+                        # The rest of the response is the summary
+                        message.summary = response.split(':')[1].strip()
+
+                    print(f'\t\t\tCategory of message {process_counter}: {message.category}')
+
+                    self.update_message_list(message.message_id, message.summary)
+
+        except Exception as e:
+            print('Error processing message:', e)
+
     def run(self):
         try:
             start_time = datetime.now(timezone.utc)
@@ -547,72 +999,50 @@ class EmailSummariser:
             # Wake up the AI models (this causes them to be loaded into memory of they are not already loaded)
             self.wake_up_ai()
 
-            # Add the allowed categories to the summarising prompt
-            self.add_categories_to_prompt()
-
             # Get the messages from the Gmail account
             self.messages_data['messages_list'] = self.get_gmail_messages()
-
-            process_counter = 1
             for message in self.messages_data['messages_list']:
-                try:
-                    # 'UNPROCESSED' is the initial category for all messages
-                    if message['category'] == 'UNPROCESSED':
-                        if len(message['plain_text']) > 0:
-                            email_text = message['plain_text']
-                        elif len(message['html']) > 0:
-                            print('Converting HTML to plain text using AI')
-                            email_text = self.ai_convert_html_to_plain_text(message['html'])
-                        else:
-                            email_text = ''
-
-                        if len(email_text) < 100:
-                            print('Email content too short to summarise')
-                        else:
-                            print('Processing message:', process_counter, 'of',
-                                  len(self.messages_data['messages_list']),
-                                  ' - ', round(len(email_text) / 1000, 1), 'Kb from', message['sender'],
-                                  '\n\t\t\twith subject:', message['subject'])
-
-                            # If the category is empty, 'UNOPROCESSED' or contains a space, get the AI to summarise the email
-                            # and if necessary, re-summarise it!
-                            while message['category'] not in allowed_categories_list:
-                                response = self.ai_summarise_email(email_text)
-
-                                # The frst word of the response is the category
-                                message['category'] = response.split(':')[0].strip().upper()
-
-                                # If the category is not in the allowed list, the AI has not understood the
-                                # email (or the content fell foul of the model's moral filters, so delete the summary.
-                                if message['category'] not in allowed_categories_list:
-                                    message['category'] = 'UNPROCESSED'
-                                    message['summary'] = '(AI did not understand the email content)'
-                                    break
-
-                                # The rest of the response is the summary
-                                message['summary'] = response.split(':')[1].strip()
-
-                            print('\t\t\tCategory:', message['category'])
-
-                            self.update_message_list(message['message_id'], message['summary'])
-
-                except Exception as e:
-                    print('Error processing message:', e)
-
-                process_counter += 1
+                self.messages_data['messages_index'].setdefault(message.message_id, message)
+
+            messages_list = self.messages_data['messages_list']
+            if not messages_list:
+                # Common with INCREMENTAL_SYNC, when no mail has arrived since the last run
+                print('No emails to summarise')
+                self.save_sync_state()
+                return
+
+            summarising_start_time = datetime.now(timezone.utc)
+
+            # Summarise up to MAX_CONCURRENT_REQUESTS messages at once. Each message is updated in place so
+            # the original message order is kept regardless of the order in which the AI responses arrive.
+            with ThreadPoolExecutor(max_workers=max(1, self.MAX_CONCURRENT_REQUESTS)) as executor:
+                list(executor.map(self.summarise_message, messages_list, range(1, len(messages_list) + 1)))
+
+            summarising_seconds = (datetime.now(timezone.utc) - summarising_start_time).total_seconds()
+            if summarising_seconds > 0:
+                print(f'Summarised {len(messages_list)} messages in {round(summarising_seconds, 1)} seconds '
+                      f'({round(len(messages_list) / summarising_seconds, 2)} messages per second '
+                      f'with up to {self.MAX_CONCURRENT_REQUESTS} concurrent requests)')
 
             print('All emails summarised successfully - now authoring summary email')
             email_message, earliest_message_datetime, latest_message_datetime = self.author_summary_email(
                 self.messages_data['messages_list'])
 
             if len(email_message) == 0:
-                print('No emails to summarise')
+                print('No summary email could be authored')
                 return
 
             print('Now sending summary email to', self.gmail_account_username)
-            self.send_summary_email(email_message, earliest_message_datetime, latest_message_datetime)
+            if self.send_summary_email(email_message, earliest_message_datetime, latest_message_datetime):
+                # Only move the high-water mark on once the messages have been summarised and sent
+                self.save_sync_state()
 
             end_time = datetime.now(timezone.utc)
+            print(f'Response cache: {self.response_cache.hits} hits, {self.response_cache.misses} misses')
+            self.print_stream_metrics()
+            self.semantic_clusterer.print_summary()
+            ollama_metrics.print_summary()
+            ollama_client.print_summary()
             print("Email AI Summarisation Ended at:", end_time)
             print('Duration:', end_time - start_time)
 
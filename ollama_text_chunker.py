@@ -0,0 +1,89 @@
+import re
+
+# English text averages about four characters per token for the Llama family of models. This errs on the side of
+# overestimating, so chunks sized with it fit comfortably in the model's context window.
+CHARS_PER_TOKEN = 4
+
+PARAGRAPH_BREAK_REGEX = re.compile(r'\n\s*\n|\n')
+SENTENCE_BREAK_REGEX = re.compile(r'(?<=[.!?])\s+')
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_oversized_piece(piece: str, max_tokens: int) -> list:
+    # Split a paragraph that is too large into sentences, then a sentence that is too large into words,
+    # and finally a word that is too large (such as a long run of HTML) into fixed-size slices
+    if estimate_tokens(piece) <= max_tokens:
+        return [piece]
+
+    sentences = [sentence for sentence in SENTENCE_BREAK_REGEX.split(piece) if sentence]
+    if len(sentences) > 1:
+        return [part for sentence in sentences for part in split_oversized_piece(sentence, max_tokens)]
+
+    words = piece.split(' ')
+    if len(words) > 1:
+        middle = len(words) // 2
+        return (split_oversized_piece(' '.join(words[:middle]), max_tokens) +
+                split_oversized_piece(' '.join(words[middle:]), max_tokens))
+
+    max_chars = max(1, (max_tokens - 1) * CHARS_PER_TOKEN)
+    return [piece[i:i + max_chars] for i in range(0, len(piece), max_chars)]
+
+
+def split_text_into_chunks(text: str, max_tokens: int) -> list:
+    # Pack whole paragraphs into chunks of no more than max_tokens, only breaking a paragraph when it is too
+    # large to fit in a chunk on its own
+    chunks = []
+    current_chunk = []
+    current_tokens = 0
+
+    for paragraph in PARAGRAPH_BREAK_REGEX.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+
+        for piece in split_oversized_piece(paragraph, max_tokens):
+            piece_tokens = estimate_tokens(piece)
+            if current_chunk and current_tokens + piece_tokens > max_tokens:
+                chunks.append('\n\n'.join(current_chunk))
+                current_chunk = []
+                current_tokens = 0
+
+            current_chunk.append(piece)
+            current_tokens += piece_tokens
+
+    if current_chunk:
+        chunks.append('\n\n'.join(current_chunk))
+
+    return chunks
+
+
+def pack_sections_into_chunks(sections, max_tokens: int):
+    # Pack whole sections (each starting with its heading) into chunks of no more than max_tokens, so chunks break
+    # between sections wherever possible. A section too large for a chunk of its own is split between paragraphs.
+    # Sections are read and chunks yielded one at a time, so a long document never has to be held all at once.
+    current_chunk = []
+    current_tokens = 0
+
+    for section in sections:
+        section_tokens = estimate_tokens(section)
+        if section_tokens > max_tokens:
+            if current_chunk:
+                yield '\n\n'.join(current_chunk)
+                current_chunk = []
+                current_tokens = 0
+            yield from split_text_into_chunks(section, max_tokens)
+            continue
+
+        if current_chunk and current_tokens + section_tokens > max_tokens:
+            yield '\n\n'.join(current_chunk)
+            current_chunk = []
+            current_tokens = 0
+
+        current_chunk.append(section)
+        current_tokens += section_tokens
+
+    if current_chunk:
+        yield '\n\n'.join(current_chunk)